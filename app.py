@@ -1,42 +1,173 @@
-from flask import Flask, jsonify, render_template
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import base64
 import time
 import os
 import logging
 import json
+import functools
+import itertools
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import types
+from collections import deque
 from dotenv import load_dotenv
 
 try:
-    from pymongo import MongoClient
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import ijson
+except Exception:
+    ijson = None
+
+try:
+    from flask_compress import Compress
+except Exception:
+    Compress = None
+
+try:
+    from pymongo import MongoClient, UpdateOne
 except Exception:
     MongoClient = None
+    UpdateOne = None
 
 from gemini_service import GeminiService
 from elevenlabs_service import ElevenLabsService
 
 load_dotenv()
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify/request.get_json con orjson; los tipos que orjson no conoce pasan por default()."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Compresión de las respuestas JSON (brotli/gzip según Accept-Encoding). Opcional.
+app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_BR_LEVEL"] = 5
+app.config["COMPRESS_LEVEL"] = 6
+app.config["COMPRESS_MIN_SIZE"] = 500
+# Con streams activados flask-compress hace get_data() y bufferiza los cursores en streaming
+app.config["COMPRESS_STREAMS"] = False
+if Compress is not None:
+    Compress(app)
+else:
+    logger.warning("⚠️ flask-compress no está instalado; las respuestas JSON irán sin comprimir.")
+
 # Coordenadas aproximadas para CDMX área
 LAT_MIN = 19.0
 LAT_MAX = 20.2
 LON_MIN = -99.5
 LON_MAX = -98.8
+BBOX = (LAT_MIN, LON_MIN, LAT_MAX, LON_MAX)
+
+# Lista de aeropuertos mexicanos (constante de solo lectura)
+AEROPUERTOS = types.MappingProxyType({
+    "MMMX": {"lat": 19.4361, "lng": -99.0719}, # Ciudad de México - AICM
+    "MMGL": {"lat": 20.5218, "lng": -103.3104}, # Guadalajara
+    "MMUN": {"lat": 25.9006, "lng": -97.4251}, # Monterrey
+    "MMMY": {"lat": 21.0365, "lng": -86.8771}, # Cancún
+    "MMQT": {"lat": 19.8517, "lng": -90.5131}, # Chetumal
+    "MMCB": {"lat": 18.5042, "lng": -88.3267}, # Chetumal (alternativo)
+    "MMTO": {"lat": 20.5833, "lng": -100.3833}, # Toluca
+    "MMHO": {"lat": 16.8517, "lng": -99.8233}, # Huatulco
+    "MMPR": {"lat": 17.9897, "lng": -92.9361}, # Palenque
+    "MMSP": {"lat": 16.5805, "lng": -93.0538}, # Tapachula
+    "MMMD": {"lat": 25.7833, "lng": -100.1}, # Ciudad Victoria
+    "MMMT": {"lat": 24.5611, "lng": -104.5911}, # Mazatlán
+    "MMES": {"lat": 20.7036, "lng": -103.3531}, # Aguascalientes
+    "MMLO": {"lat": 18.1122, "lng": -96.8728}, # Loreto
+    "MMZL": {"lat": 19.9847, "lng": -102.2833}, # Zamora
+    "MMCS": {"lat": 20.6533, "lng": -103.325}, # Colima
+    "MMVA": {"lat": 18.7758, "lng": -99.1817}, # Valle de Bravo
+    "MMOX": {"lat": 17.0667, "lng": -96.7167}, # Oaxaca
+    "MMSD": {"lat": 20.9167, "lng": -89.6167}, # Mérida
+    "MMTB": {"lat": 16.7567, "lng": -93.1294}, # Tapachula
+    "MMZC": {"lat": 21.0333, "lng": -86.8667}, # Cozumel
+    "MMTM": {"lat": 16.75, "lng": -93.1167}, # Tapachula
+    "MMTX": {"lat": 18.45, "lng": -95.2333}, # Tuxtepec
+    "MMAN": {"lat": 19.8833, "lng": -98.2833}, # San Luis Potosí
+    "MMBJ": {"lat": 19.3333, "lng": -99.15}, # Bajío
+})
 
 # Credenciales OAuth para acceso a la API (preferir variables de entorno)
 CLIENT_ID = os.environ.get("OPENSKY_CLIENT_ID", "pop-api-client")
 CLIENT_SECRET = os.environ.get("OPENSKY_CLIENT_SECRET", "nBLFkW00mznAUsbmcJvEgAr88msF82WT")
 
-# Cache para token y expiración
+# Sesión HTTP compartida: reutiliza conexiones (keep-alive) hacia OpenSky y Zabbix
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False,
+    ),
+)
+SESSION.mount("https://opensky-network.org", _adapter)
+SESSION.mount("https://auth.opensky-network.org", _adapter)
+# Resto de hosts (Zabbix): mismo pool, sin reintentos automáticos de POST JSON-RPC
+_default_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+SESSION.mount("https://", _default_adapter)
+SESSION.mount("http://", _default_adapter)
+SESSION.headers.update({"User-Agent": "MiAppDeVuelos/1.0"})
+
+# Cache para token y expiración. `expires_at` se adelanta TOKEN_REFRESH_MARGIN
+# segundos para renovar antes de que OpenSky lo rechace; `valid_until` es la
+# expiración real y permite seguir usando el token si la renovación falla.
+TOKEN_REFRESH_MARGIN = 90
+# Tras un fallo de renovación se espera antes de reintentar (5 s, 10 s, ... hasta 60 s)
+TOKEN_RETRY_MIN = 5
+TOKEN_RETRY_MAX = 60
 token_cache = {
     "access_token": None,
     "expires_at": 0,
+    "valid_until": 0,
+    "retry_at": 0,
+    "backoff": 0,
 }
-
-alerts_history = []
+_token_lock = threading.Lock()
+_token_refresher_thread = None
+
+# Cache de respuestas JSON ya serializadas. OpenSky actualiza cada ~5-10 s, así que
+# los clientes que consultan dentro de la ventana comparten una sola llamada.
+RESPONSE_CACHE_TTL = 5
+response_cache = {}
+# clave de caché -> {"hits", "misses"}; /vuelos y /analyze/predict tienen TTL distintos
+response_cache_stats = {}
+_cache_stats_lock = threading.Lock()
+VUELOS_CACHE_KEY = ("vuelos",) + BBOX
+
+alerts_history = deque(maxlen=100)
+# id -> alerta, con las mismas entradas que alerts_history (búsqueda O(1) para /alerts/<id>/audio)
+alerts_by_id = {}
+# (tipo de alerta, icao24) -> timestamp de la última alerta emitida, para no repetirlas
+ALERT_COOLDOWN = 300
+_recent_alert_keys = {}
+# (id, tipo) de las alertas cuyo insert_many en segundo plano aún no termina
+_pending_alert_keys = set()
+_pending_alerts_lock = threading.Lock()
 alerts_config = {
     "cargo_entry_enabled": True,
     "high_count_enabled": True,
@@ -48,6 +179,18 @@ alerts_config = {
     "sound_enabled": True
 }
 
+# Alertas persistidas en una colección capped: compartidas entre workers y sin recorte manual
+ALERTS_COLLECTION_SIZE = 1_000_000
+ALERTS_COLLECTION_MAX = 10_000
+
+
+def _ensure_alerts_collection(database):
+    if "alerts" not in database.list_collection_names():
+        database.create_collection(
+            "alerts", capped=True, size=ALERTS_COLLECTION_SIZE, max=ALERTS_COLLECTION_MAX
+        )
+
+
 # MongoDB setup (optional). Set MONGODB_URI in env to enable persistent storage.
 MONGODB_URI = os.environ.get("MONGODB_URI")
 db_client = None
@@ -58,6 +201,18 @@ if MONGODB_URI and MongoClient is not None:
         db_client.server_info()  # Test connection
         db = db_client.get_default_database()
         logger.info("✅ Conectado a MongoDB para app.py.")
+        try:
+            db.flights.create_index("icao24", unique=True)
+            db.flights.create_index([("type", 1), ("icao24", 1)])
+            db.flights.create_index("last_seen")
+            db.historical_data.create_index([("timestamp", -1)])
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron crear los índices de MongoDB: {e}")
+        # Aparte: si falla un índice, la capped debe existir igual antes del primer insert_many
+        try:
+            _ensure_alerts_collection(db)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo crear la colección capped de alertas: {e}")
     except Exception as e:
         logger.warning(f"⚠️ No se pudo conectar a MongoDB: {e}")
         db_client = None
@@ -70,6 +225,14 @@ else:
 ZABBIX_API = os.environ.get("ZABBIX_API")
 ZABBIX_USER = os.environ.get("ZABBIX_USER")
 ZABBIX_PASS = os.environ.get("ZABBIX_PASS")
+ZABBIX_HOST = os.environ.get("ZABBIX_HOST", "ghostflight")
+
+# Zabbix auth tokens are long-lived; reuse them instead of logging in per metric
+ZABBIX_TOKEN_TTL = 3600
+zabbix_token_cache = {
+    "auth": None,
+    "expires_at": 0,
+}
 
 # Load operator mapping (optional) to improve classification
 OPERATOR_MAP = {"cargo_prefixes": [], "commercial_prefixes": []}
@@ -78,46 +241,134 @@ try:
     if os.path.exists(mapping_path):
         with open(mapping_path, "r", encoding="utf-8") as fh:
             OPERATOR_MAP = json.load(fh)
-            # normalize to upper-case
-            OPERATOR_MAP["cargo_prefixes"] = [p.upper() for p in OPERATOR_MAP.get("cargo_prefixes", [])]
-            OPERATOR_MAP["commercial_prefixes"] = [p.upper() for p in OPERATOR_MAP.get("commercial_prefixes", [])]
             logger.info("Loaded operator mapping for classification")
 except Exception as e:
     logger.warning(f"Could not load operator mapping: {e}")
 
+# Fallback: simple built-in cargo prefixes
+FALLBACK_CARGO_PREFIXES = ["FDX", "UPS", "DHX", "DHL", "CVG", "CLX", "AMX", "NCA", "GEC", "GTI"]
+
+def _build_prefix_index(groups):
+    """Compila grupos (etiqueta, prefijos) en un índice {prefijo: etiqueta} y sus longitudes.
+
+    Es un trie aplanado: cada nodo terminal se guarda por su prefijo completo, así
+    que buscar un callsign cuesta una consulta al dict por longitud distinta
+    (2-3 en la práctica), sin importar cuántos prefijos haya. Si un prefijo aparece
+    en varios grupos gana el primero.
+    """
+    labels = {}
+    for label, prefixes in groups:
+        for prefix in prefixes:
+            labels.setdefault(prefix.upper(), label)
+    lengths = tuple(sorted({len(p) for p in labels}, reverse=True))
+    return labels, lengths
+
+
+def _derive_operator_map(mapping):
+    """Normaliza el mapping a mayúsculas y deriva de él todas las estructuras de clasificación.
+
+    Devuelve (OPERATOR_MAP, PREFIX_LABELS, _PREFIX_LENGTHS); lo usan tanto la carga
+    inicial como reload_operator_map para que nunca diverjan.
+    """
+    normalized = dict(mapping)
+    normalized["cargo_prefixes"] = [p.upper() for p in mapping.get("cargo_prefixes", [])]
+    normalized["commercial_prefixes"] = [p.upper() for p in mapping.get("commercial_prefixes", [])]
+    labels, lengths = _build_prefix_index([
+        ("carga", normalized["cargo_prefixes"] + FALLBACK_CARGO_PREFIXES),
+        ("comercial", normalized["commercial_prefixes"]),
+    ])
+    return normalized, labels, lengths
+
+
+OPERATOR_MAP, PREFIX_LABELS, _PREFIX_LENGTHS = _derive_operator_map(OPERATOR_MAP)
+
 seen_cargo_flights = set()
 
+# Background workers for writes that must not block the request path (Mongo, Zabbix).
+# The semaphore bounds queued + running tasks so a slow backend cannot pile up work.
+BACKGROUND_MAX_PENDING = 16
+MONGO_BULK_CHUNK = 1000
+EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ghostflight-bg")
+_background_slots = threading.BoundedSemaphore(BACKGROUND_MAX_PENDING)
+
 gemini_service = GeminiService()
 elevenlabs_service = ElevenLabsService()
 
+def _token_usable(now):
+    """True si el token cacheado sirve sin llamar a OAuth2: vigente, o aún válido mientras
+    una renovación fallida está en espera de reintento."""
+    if not token_cache["access_token"]:
+        return False
+    if token_cache["expires_at"] > now:
+        return True
+    return token_cache["retry_at"] > now and token_cache["valid_until"] > now
+
+
 def obtener_token():
-    if token_cache["access_token"] and token_cache["expires_at"] > time.time():
-        return token_cache["access_token"]
-    
-    url = "https://auth.opensky-network.org/auth/realms/opensky-network/protocol/openid-connect/token"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID.strip(),
-        "client_secret": CLIENT_SECRET.strip()
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, data=data)
-        response.raise_for_status()
-        json_data = response.json()
-        token_cache["access_token"] = json_data.get("access_token")
-        expires_in = json_data.get("expires_in", 1800)
-        token_cache["expires_at"] = time.time() + expires_in
+    if _token_usable(time.time()):
         return token_cache["access_token"]
-    except requests.HTTPError as e:
-        if e.response is not None:
-            print(f"Error al obtener OAuth2: {e.response.status_code} - {e.response.text}")
-        else:
-            print(f"Error al obtener OAuth2: {e}")
-        raise
+
+    # Solo un hilo renueva; el resto espera y reutiliza el token recién obtenido
+    with _token_lock:
+        if _token_usable(time.time()):
+            return token_cache["access_token"]
+        
+        url = "https://auth.opensky-network.org/auth/realms/opensky-network/protocol/openid-connect/token"
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": CLIENT_ID.strip(),
+            "client_secret": CLIENT_SECRET.strip()
+        }
+        
+        try:
+            response = SESSION.post(url, headers=headers, data=data, timeout=10)
+            response.raise_for_status()
+            json_data = response.json()
+            expires_in = json_data.get("expires_in", 1800)
+            now = time.time()
+            token_cache["access_token"] = json_data.get("access_token")
+            token_cache["valid_until"] = now + expires_in
+            token_cache["expires_at"] = now + max(expires_in - TOKEN_REFRESH_MARGIN, 0)
+            token_cache["retry_at"] = token_cache["backoff"] = 0
+            return token_cache["access_token"]
+        except requests.RequestException as e:
+            if isinstance(e, requests.HTTPError) and e.response is not None:
+                logger.warning("Error al obtener OAuth2: %s - %s", e.response.status_code, e.response.text)
+            else:
+                logger.warning("Error al obtener OAuth2: %s", e)
+            token_cache["backoff"] = min(max(token_cache["backoff"] * 2, TOKEN_RETRY_MIN), TOKEN_RETRY_MAX)
+            token_cache["retry_at"] = time.time() + token_cache["backoff"]
+            if token_cache["access_token"] and token_cache["valid_until"] > time.time():
+                logger.warning("Usando el token OAuth2 anterior hasta su expiración real")
+                return token_cache["access_token"]
+            raise
+
+
+def _token_refresher():
+    """Renueva el token antes de que expire para que las peticiones nunca esperen a OAuth2."""
+    while True:
+        try:
+            obtener_token()
+        except Exception as e:
+            logger.warning("Renovación de token en segundo plano fallida: %s", e)
+        # Tras un fallo se respeta el backoff en lugar de reintentar cada segundo
+        now = time.time()
+        wait = token_cache["retry_at"] - now if token_cache["retry_at"] > now else token_cache["expires_at"] - now
+        time.sleep(max(wait, 1))
+
+
+def start_token_refresher():
+    """Arranca (una vez por proceso) el hilo que mantiene el token de OpenSky caliente."""
+    global _token_refresher_thread
+    if _token_refresher_thread is None:
+        _token_refresher_thread = threading.Thread(
+            target=_token_refresher, name="opensky-token-refresher", daemon=True
+        )
+        _token_refresher_thread.start()
+    return _token_refresher_thread
 
 
 def classify_flight(callsign: str) -> str:
@@ -128,30 +379,81 @@ def classify_flight(callsign: str) -> str:
     """
     if not callsign:
         return "desconocido"
-    s = callsign.strip().upper()
-    # First, check mapping file prefixes
-    for p in OPERATOR_MAP.get("cargo_prefixes", []):
-        if s.startswith(p):
-            return "carga"
-    for p in OPERATOR_MAP.get("commercial_prefixes", []):
-        if s.startswith(p):
-            return "comercial"
-
-    # Fallback: simple built-in cargo prefixes
-    fallback_cargo = ["FDX", "UPS", "DHX", "DHL", "CVG", "CLX", "AMX", "NCA", "GEC", "GTI"]
-    for p in fallback_cargo:
-        if s.startswith(p):
-            return "carga"
+    # Solo importan los primeros caracteres (el prefijo más largo), así la caché
+    # tiene una entrada por operador y no una por vuelo
+    return _classify_cached(callsign.strip().upper()[:_PREFIX_LENGTHS[0]])
+
+
+@functools.lru_cache(maxsize=4096)
+def _classify_cached(s_upper: str) -> str:
+    # Longest known operator prefix wins
+    for n in _PREFIX_LENGTHS:
+        label = PREFIX_LABELS.get(s_upper[:n])
+        if label is not None:
+            return label
 
     # Default to 'comercial' if nothing matched
     return "comercial"
 
-def check_alerts(vuelos):
-    """Check flight data against alert rules and generate alerts"""
+
+def reload_operator_map(mapping):
+    """Sustituye OPERATOR_MAP en caliente, reconstruye el índice y vacía la caché de clasificación."""
+    global OPERATOR_MAP, PREFIX_LABELS, _PREFIX_LENGTHS
+    OPERATOR_MAP, PREFIX_LABELS, _PREFIX_LENGTHS = _derive_operator_map(mapping)
+    _classify_cached.cache_clear()
+
+def _alert_recently_sent(key, now):
+    """True si ya se emitió esta alerta dentro de ALERT_COOLDOWN; si no, la registra."""
+    last = _recent_alert_keys.get(key)
+    if last is not None and now - last < ALERT_COOLDOWN:
+        return True
+    _recent_alert_keys[key] = now
+    return False
+
+
+def _alert_key(alert):
+    return alert["id"], alert["type"]
+
+
+def _forget_pending_alerts(alerts):
+    with _pending_alerts_lock:
+        _pending_alert_keys.difference_update(_alert_key(a) for a in alerts)
+
+
+def _store_alerts(alerts):
+    try:
+        db.alerts.insert_many(alerts, ordered=False)
+    except Exception as e:
+        logger.warning(f"Mongo alerts write failed ({len(alerts)} alerts): {e}")
+    finally:
+        _forget_pending_alerts(alerts)
+
+
+def _record_alerts(new_alerts):
+    """Añade alertas al historial acotado y mantiene alerts_by_id sincronizado al desalojar."""
+    for alert in new_alerts:
+        if len(alerts_history) == alerts_history.maxlen:
+            oldest = alerts_history[0]
+            if alerts_by_id.get(oldest["id"]) is oldest:
+                del alerts_by_id[oldest["id"]]
+        alerts_history.append(alert)
+        # Varias alertas del mismo ciclo pueden compartir id; se conserva la primera
+        alerts_by_id.setdefault(alert["id"], alert)
+
+
+def check_alerts(vuelos, count_cargo=None):
+    """Check flight data against alert rules and generate alerts.
+
+    `count_cargo` lets the caller pass the cargo count it already has, avoiding another pass.
+    """
     new_alerts = []
+    now = int(time.time())
+    for key in [k for k, ts in _recent_alert_keys.items() if now - ts >= ALERT_COOLDOWN]:
+        del _recent_alert_keys[key]
     
     # Count cargo and total flights
-    count_cargo = sum(1 for v in vuelos if v.get("type") == "carga")
+    if count_cargo is None:
+        count_cargo = sum(1 for v in vuelos if v.get("type") == "carga")
     count_total = len(vuelos)
     
     # Alert: New cargo flight entry
@@ -189,7 +491,7 @@ def check_alerts(vuelos):
             }
         }
         # Only add if not recently added
-        if not any(a.get("type") == "high_count" for a in alerts_history[-5:]):
+        if not _alert_recently_sent(("high_count", None), now):
             new_alerts.append(alert)
     
     # Alert: Low altitude flights
@@ -210,7 +512,7 @@ def check_alerts(vuelos):
                     }
                 }
                 # Only add if not recently added for this flight
-                if not any(a.get("flight_data", {}).get("icao24") == vuelo.get("icao24") and a.get("type") == "low_altitude" for a in alerts_history[-10:]):
+                if not _alert_recently_sent(("low_altitude", vuelo.get("icao24")), now):
                     new_alerts.append(alert)
     
     # Alert: Abnormal speed
@@ -230,126 +532,329 @@ def check_alerts(vuelos):
                         "velocity": vuelo.get("velocity")
                     }
                 }
-                if not any(a.get("flight_data", {}).get("icao24") == vuelo.get("icao24") and a.get("type") == "abnormal_speed" for a in alerts_history[-10:]):
+                if not _alert_recently_sent(("abnormal_speed", vuelo.get("icao24")), now):
                     new_alerts.append(alert)
     
-    # Add new alerts to history
-    alerts_history.extend(new_alerts)
-    
-    # Keep only last 100 alerts
-    if len(alerts_history) > 100:
-        del alerts_history[:-100]
+    # Add new alerts to history (the deque keeps only the last 100)
+    _record_alerts(new_alerts)
+    if db is not None and new_alerts:
+        # Copies: insert_many adds an ObjectId `_id` to each document it inserts
+        docs = [dict(a) for a in new_alerts]
+        with _pending_alerts_lock:
+            _pending_alert_keys.update(_alert_key(a) for a in docs)
+        if submit_background(_store_alerts, docs) is None:
+            _forget_pending_alerts(docs)
     
     return new_alerts
 
 
-def send_zabbix_metric(metric_name: str, value):
-    """Optional: send a simple metric to Zabbix API if configured. Non-blocking and best-effort."""
-    if not ZABBIX_API or not ZABBIX_USER or not ZABBIX_PASS:
+def _release_background_slot(future):
+    _background_slots.release()
+    exc = future.exception()
+    if exc is not None:
+        logger.warning(f"Background task failed: {exc}")
+
+
+def submit_background(fn, *args):
+    """Run `fn(*args)` on the background executor; drop it if too many tasks are pending."""
+    if not _background_slots.acquire(blocking=False):
+        logger.warning(f"Background queue full; dropping {fn.__name__}")
+        return None
+    future = EXECUTOR.submit(fn, *args)
+    future.add_done_callback(_release_background_slot)
+    return future
+
+
+def _zabbix_auth():
+    """Return a cached Zabbix auth token, logging in only when it is missing or stale."""
+    if zabbix_token_cache["auth"] and zabbix_token_cache["expires_at"] > time.time():
+        return zabbix_token_cache["auth"]
+    # Zabbix >= 6.4 takes "username"; history.push (below) already requires 7.0
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "user.login",
+        "params": {"username": ZABBIX_USER, "password": ZABBIX_PASS},
+        "id": 1,
+    }
+    resp = SESSION.post(ZABBIX_API, json=payload, timeout=5)
+    resp.raise_for_status()
+    body = resp.json()
+    if body.get("error"):
+        logger.warning(f"Zabbix user.login failed: {body['error']}")
+        return None
+    auth = body.get("result")
+    if auth:
+        zabbix_token_cache["auth"] = auth
+        zabbix_token_cache["expires_at"] = time.time() + ZABBIX_TOKEN_TTL
+    return auth
+
+
+def send_zabbix_metrics(metrics: dict):
+    """Optional: push several metrics to Zabbix in one JSON-RPC call if configured. Best-effort.
+
+    Uses `history.push` (Zabbix >= 7.0) against trapper items `metric_name` on ZABBIX_HOST.
+    """
+    if not ZABBIX_API or not ZABBIX_USER or not ZABBIX_PASS or not metrics:
         return
     try:
-        # Basic login to Zabbix API and send a simple item via 'event' is project-specific.
-        # Here we only perform a login to verify credentials (no complex item creation).
+        auth = _zabbix_auth()
+        if not auth:
+            return
         payload = {
             "jsonrpc": "2.0",
-            "method": "user.login",
-            "params": {"user": ZABBIX_USER, "password": ZABBIX_PASS},
-            "id": 1,
-            "auth": None,
+            "method": "history.push",
+            "params": [
+                {"host": ZABBIX_HOST, "key": name, "value": value}
+                for name, value in metrics.items()
+            ],
+            "id": 2,
         }
-        resp = requests.post(ZABBIX_API, json=payload, timeout=5)
+        # The "auth" body field was removed in Zabbix 7.2; the token goes in the header
+        resp = SESSION.post(ZABBIX_API, json=payload, headers={"Authorization": f"Bearer {auth}"}, timeout=5)
         resp.raise_for_status()
-        auth = resp.json().get("result")
-        if not auth:
-            return
-        # We won't implement full item sending here (requires host/item ids). This is a placeholder.
-        logger.info("Zabbix login successful (placeholder).")
+        error = resp.json().get("error")
+        if error:
+            # The session may have been invalidated server-side; log in again next time
+            zabbix_token_cache["auth"] = None
+            logger.warning(f"Zabbix history.push failed: {error}")
     except Exception as e:
         logger.warning(f"Zabbix metric send failed: {e}")
 
+
+def _count_cache(key, field):
+    with _cache_stats_lock:
+        stats = response_cache_stats.setdefault(key, {"hits": 0, "misses": 0})
+        stats[field] += 1
+
+
+def _cached_json(key, build, ttl=RESPONSE_CACHE_TTL):
+    """Devuelve (json, etag, datos) de `build()` reutilizándolos durante `ttl` segundos.
+
+    Los tres se guardan como una sola tupla para que un lector nunca mezcle dos versiones.
+    Las peticiones concurrentes con la caché expirada esperan al primer hilo
+    en lugar de repetir la llamada a OpenSky.
+    """
+    entry = response_cache.setdefault(key, {"ts": 0, "value": None, "lock": threading.Lock()})
+    value = entry["value"]
+    if value is not None and time.time() - entry["ts"] < ttl:
+        _count_cache(key, "hits")
+        return value
+    with entry["lock"]:
+        value = entry["value"]
+        if value is not None and time.time() - entry["ts"] < ttl:
+            _count_cache(key, "hits")
+            return value
+        _count_cache(key, "misses")
+        try:
+            data = build()
+            body = _dumps(data)
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and 400 <= status < 500:
+                # Invalidate on 4xx; a 401 also means the cached OAuth token was rejected
+                entry["value"] = None
+                if status == 401:
+                    token_cache["access_token"] = None
+            raise
+        value = (body, hashlib.blake2b(body, digest_size=8).hexdigest(), data)
+        entry["value"] = value
+        entry["ts"] = time.time()
+        return value
+
+
+def _dumps(obj) -> bytes:
+    """Serializa a JSON con orjson (C) si está instalado; si no, con la librería estándar."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def _loads(data):
+    """Parsea JSON (bytes o str) con orjson si está instalado; si no, con la librería estándar."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _iter_json_array(docs):
+    """Yield a JSON array chunk by chunk, one document at a time."""
+    yield b"["
+    first = True
+    for doc in docs:
+        if not first:
+            yield b","
+        first = False
+        yield _dumps(doc)
+    yield b"]"
+
+
+def _stream_cursor_response(cursor, headers=None):
+    """Responde un cursor de Mongo como array JSON en streaming.
+
+    El primer lote se pide aquí, dentro del try del handler: el cursor es perezoso y
+    un error de Mongo durante el stream llegaría como un 200 con el array cortado.
+    """
+    first = next(cursor, None)
+    docs = cursor if first is None else itertools.chain((first,), cursor)
+    return Response(stream_with_context(_iter_json_array(docs)), mimetype="application/json", headers=headers)
+
+
+def _json_body(body, status=200):
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+def _json_response(obj, status=200):
+    return _json_body(_dumps(obj), status=status)
+
+
+def _etag_json_response(body, etag, max_age):
+    """Respuesta JSON con ETag; responde 304 sin cuerpo si el cliente ya la tiene."""
+    # flask-compress añade ":gzip"/":br" al ETag; se compara solo la parte del contenido
+    if any(tag.split(":", 1)[0] == etag for tag in request.if_none_match.as_set()):
+        response = app.response_class(status=304)
+    else:
+        response = _json_body(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return response
+
+
+def _cached_json_response(key, build, ttl=RESPONSE_CACHE_TTL):
+    """Respuesta JSON cacheada `ttl` segundos y servida con ETag."""
+    body, etag, _ = _cached_json(key, build, ttl)
+    return _etag_json_response(body, etag, ttl)
+
+
+def _iter_states(response):
+    """Iterate the state vectors of a /states/all response opened with stream=True.
+
+    With ijson the rows are decoded one at a time straight from the socket, so the
+    full OpenSky document is never materialized; otherwise parse the whole body at once.
+    """
+    if ijson is None:
+        return iter(_loads(response.content).get("states") or ())
+    response.raw.decode_content = True
+    return ijson.items(response.raw, "states.item", use_float=True)
+
+
+def _with_position(states):
+    """Drop OpenSky state vectors without latitude/longitude lazily, before building dicts."""
+    return (estado for estado in states or () if estado[5] is not None and estado[6] is not None)
+
+
+def _bulk_upsert_flights(vuelos):
+    """Upsert flights by icao24 with unordered bulk_write, MONGO_BULK_CHUNK ops per round-trip."""
+    coll = db.get_collection("flights")
+    for start in range(0, len(vuelos), MONGO_BULK_CHUNK):
+        ops = [
+            UpdateOne(
+                {"icao24": vuelo["icao24"]},
+                {"$set": vuelo, "$currentDate": {"last_seen": True}},
+                upsert=True,
+            )
+            for vuelo in vuelos[start:start + MONGO_BULK_CHUNK]
+        ]
+        try:
+            coll.bulk_write(ops, ordered=False)
+        except Exception as e:
+            logger.warning(f"Mongo bulk write failed ({len(ops)} flights): {e}")
+
+
 @app.route("/")
 def index():
     return render_template("mapa.html")
 
-@app.route("/vuelos")
-def vuelos():
+def _fetch_and_classify_states(bbox=BBOX):
+    """Descarga los state vectors de OpenSky dentro de `bbox` y los devuelve ya clasificados.
+
+    Devuelve (vuelos, conteo por tipo); el conteo se hace en la misma pasada que la
+    clasificación para no recorrer la lista otra vez.
+    """
+    lamin, lomin, lamax, lomax = bbox
     url = "https://opensky-network.org/api/states/all"
     params = {
-        "lamin": LAT_MIN,
-        "lomin": LON_MIN,
-        "lamax": LAT_MAX,
-        "lomax": LON_MAX
+        "lamin": lamin,
+        "lomin": lomin,
+        "lamax": lamax,
+        "lomax": lomax
     }
-    
-    try:
-        token = obtener_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": "MiAppDeVuelos/1.0"
-        }
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        vuelos = []
-        now_ts = int(time.time())
-        for estado in data.get("states", []):
-            lat = estado[6]
-            lon = estado[5]
-            if lat is None or lon is None:
-                continue
 
+    token = obtener_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    vuelos = []
+    counts = {"comercial": 0, "carga": 0}
+    now_ts = int(time.time())
+    with SESSION.get(url, headers=headers, params=params, timeout=10, stream=True) as response:
+        response.raise_for_status()
+        for estado in _with_position(_iter_states(response)):
             callsign = estado[1].strip() if estado[1] else ""
             tipo = classify_flight(callsign)
-
-            vuelo = {
+            counts[tipo] = counts.get(tipo, 0) + 1
+            vuelos.append({
                 "icao24": estado[0],
                 "callsign": callsign if callsign else "N/A",
                 "origin_country": estado[2],
-                "latitude": lat,
-                "longitude": lon,
+                "latitude": estado[6],
+                "longitude": estado[5],
                 "altitude": estado[7],
                 "velocity": estado[9],
                 "heading": estado[10],
                 "type": tipo,
                 "fetched_at": now_ts,
-            }
-            vuelos.append(vuelo)
-
-            # Persist latest info per aircraft (upsert) if DB available
-            try:
-               
-                if db is not None: 
-                    db.get_collection("flights").update_one({"icao24": estado[0]}, {"$set": vuelo}, upsert=True)
-            except Exception as e:
-                logger.warning(f"Mongo write failed for {vuelo.get('icao24')}: {e}")
-
-        check_alerts(vuelos)
+            })
+    return vuelos, counts
+
+
+def _refresh_vuelos():
+    vuelos, counts = _fetch_and_classify_states(BBOX)
+    check_alerts(vuelos, count_cargo=counts["carga"])
+
+    # Persistence and telemetry happen out-of-band so the client gets the payload immediately.
+    # Separate tasks, so a slow Zabbix does not hold back the Mongo write (or vice versa).
+    if db is not None and vuelos:
+        submit_background(_bulk_upsert_flights, vuelos)
+    if ZABBIX_API:
+        submit_background(send_zabbix_metrics, {
+            "flights.comercial.count": counts["comercial"],
+            "flights.carga.count": counts["carga"],
+        })
 
-        # Optional: send metrics to Zabbix (counts)
-        try:
-            count_comercial = sum(1 for v in vuelos if v.get("type") == "comercial")
-            count_carga = sum(1 for v in vuelos if v.get("type") == "carga")
-            send_zabbix_metric("flights.comercial.count", count_comercial)
-            send_zabbix_metric("flights.carga.count", count_carga)
-        except Exception as e:
-            logger.debug(f"Zabbix metric error: {e}")
+    return vuelos
 
-        return jsonify(vuelos)
+@app.route("/vuelos")
+def vuelos():
+    try:
+        return _cached_json_response(VUELOS_CACHE_KEY, _refresh_vuelos)
     
     except requests.HTTPError as e:
         if e.response is not None and e.response.status_code == 429:
             return jsonify({"error": "Límite de peticiones alcanzado. Intenta más tarde."}), 429
-        print(f"Error HTTP al consultar OpenSky: {e}")
+        logger.warning("Error HTTP al consultar OpenSky: %s", e)
         return jsonify({"error": "Error al consultar OpenSky"}), 500
     except Exception as e:
-        print(f"Error general: {e}")
+        logger.exception("Error general: %s", e)
         return jsonify({"error": "Error interno"}), 500
 
 @app.route("/alerts")
 def get_alerts():
     """Return recent alerts"""
-    return jsonify(alerts_history[-20:]), 200
+    if db is not None:
+        try:
+            recent = list(db.alerts.find({}, {"_id": 0}).sort("_id", -1).limit(20))
+            recent.reverse()
+            # La escritura en Mongo va en segundo plano: se suman solo las alertas de este
+            # worker con el insert aún en curso (no todo el historial local, que tras un
+            # /alerts/clear en otro worker volvería a aparecer)
+            with _pending_alerts_lock:
+                pending_keys = set(_pending_alert_keys)
+            stored = {(a.get("id"), a.get("type")) for a in recent}
+            pending = [a for a in alerts_history
+                       if _alert_key(a) in pending_keys and _alert_key(a) not in stored]
+            merged = sorted(recent + pending, key=lambda a: (a.get("timestamp", 0), a.get("id", 0)))
+            return _json_response(merged[-20:])
+        except Exception as e:
+            logger.warning(f"Mongo alerts read failed, using in-memory history: {e}")
+    return _json_response(list(alerts_history)[-20:])
 
 @app.route("/alerts/config")
 def get_alerts_config():
@@ -374,88 +879,100 @@ def update_alerts_config():
 def clear_alerts():
     """Clear alerts history"""
     alerts_history.clear()
+    alerts_by_id.clear()
+    _recent_alert_keys.clear()
     seen_cargo_flights.clear()
+    with _pending_alerts_lock:
+        _pending_alert_keys.clear()
+    if db is not None:
+        try:
+            # delete_many sobre la capped (MongoDB >= 5.0) no la recrea, así que un
+            # _store_alerts pendiente no puede dejar una colección "alerts" sin límite
+            db.alerts.delete_many({})
+        except Exception as e:
+            logger.warning(f"Mongo alerts clear failed: {e}")
     return jsonify({"success": True}), 200
 
 @app.route("/alerts/export")
 def export_alerts():
     """Export alerts to JSON"""
     from flask import Response
-    json_data = json.dumps(alerts_history, indent=2)
+    headers = {"Content-Disposition": f"attachment;filename=alerts_export_{int(time.time())}.json"}
+    if db is not None:
+        try:
+            cursor = db.alerts.find({}, {"_id": 0}).sort("_id", 1).batch_size(MONGO_FIND_BATCH)
+            return _stream_cursor_response(cursor, headers)
+        except Exception as e:
+            logger.warning(f"Mongo alerts export failed, using in-memory history: {e}")
+    json_data = json.dumps(list(alerts_history), indent=2)
     return Response(
         json_data,
         mimetype="application/json",
-        headers={"Content-Disposition": f"attachment;filename=alerts_export_{int(time.time())}.json"}
+        headers=headers
     )
 
+@functools.lru_cache(maxsize=1024)
+def _fetch_last_flight(icao24_lc, hour_bucket):
+    """Último vuelo de la aeronave en las 24 h previas al fin de `hour_bucket`.
+
+    Devuelve (origen, destino, callsign) o None. Se cachea por hora porque el
+    navegador suele repetir la misma consulta y /flights/aircraft es lento.
+    """
+    end = (hour_bucket + 1) * 3600
+    token = obtener_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    url = "https://opensky-network.org/api/flights/aircraft"
+    params = {
+        "icao24": icao24_lc,
+        "begin": end - 24*3600,
+        "end": end
+    }
+    resp = SESSION.get(url, headers=headers, params=params, timeout=10)
+    resp.raise_for_status()
+    vuelos = _loads(resp.content)
+    if not vuelos:
+        return None
+    vuelo = vuelos[-1] # vuelo más reciente
+    return vuelo.get("estDepartureAirport"), vuelo.get("estArrivalAirport"), vuelo.get("callsign")
+
+
+# Audio de alertas generado con ElevenLabs, por hash de la narración. Es caché por proceso:
+# otro worker solo tendría que regenerarlo. El más antiguo sale primero
+AUDIO_CACHE_MAX = 64
+AUDIO_MAX_AGE = 86400
+_AUDIO_CACHE = {}
+_audio_lock = threading.Lock()
+
+
+def _store_audio(key, audio_data):
+    """Guarda un MP3 en memoria; descarta el más antiguo al superar AUDIO_CACHE_MAX."""
+    with _audio_lock:
+        _AUDIO_CACHE.pop(key, None)
+        _AUDIO_CACHE[key] = audio_data
+        while len(_AUDIO_CACHE) > AUDIO_CACHE_MAX:
+            _AUDIO_CACHE.pop(next(iter(_AUDIO_CACHE)))
+
 @app.route("/ruta_vuelo/<string:icao24>")
 def ruta_vuelo(icao24):
     now = int(time.time())
-    begin = now - 24*3600
     
-    # Lista de aeropuertos mexicanos (78 principales)
-    aeropuertos = {
-        "MMMX": {"lat": 19.4361, "lng": -99.0719}, # Ciudad de México - AICM
-        "MMGL": {"lat": 20.5218, "lng": -103.3104}, # Guadalajara
-        "MMUN": {"lat": 25.9006, "lng": -97.4251}, # Monterrey
-        "MMMY": {"lat": 21.0365, "lng": -86.8771}, # Cancún
-        "MMQT": {"lat": 19.8517, "lng": -90.5131}, # Chetumal
-        "MMCB": {"lat": 18.5042, "lng": -88.3267}, # Chetumal (alternativo)
-        "MMTO": {"lat": 20.5833, "lng": -100.3833}, # Toluca
-        "MMHO": {"lat": 16.8517, "lng": -99.8233}, # Huatulco
-        "MMPR": {"lat": 17.9897, "lng": -92.9361}, # Palenque
-        "MMSP": {"lat": 16.5805, "lng": -93.0538}, # Tapachula
-        "MMMD": {"lat": 25.7833, "lng": -100.1}, # Ciudad Victoria
-        "MMMT": {"lat": 24.5611, "lng": -104.5911}, # Mazatlán
-        "MMES": {"lat": 20.7036, "lng": -103.3531}, # Aguascalientes
-        "MMLO": {"lat": 18.1122, "lng": -96.8728}, # Loreto
-        "MMZL": {"lat": 19.9847, "lng": -102.2833}, # Zamora
-        "MMCS": {"lat": 20.6533, "lng": -103.325}, # Colima
-        "MMVA": {"lat": 18.7758, "lng": -99.1817}, # Valle de Bravo
-        "MMOX": {"lat": 17.0667, "lng": -96.7167}, # Oaxaca
-        "MMSD": {"lat": 20.9167, "lng": -89.6167}, # Mérida
-        "MMTB": {"lat": 16.7567, "lng": -93.1294}, # Tapachula
-        "MMZC": {"lat": 21.0333, "lng": -86.8667}, # Cozumel
-        "MMTM": {"lat": 16.75, "lng": -93.1167}, # Tapachula
-        "MMTX": {"lat": 18.45, "lng": -95.2333}, # Tuxtepec
-        "MMAN": {"lat": 19.8833, "lng": -98.2833}, # San Luis Potosí
-        "MMBJ": {"lat": 19.3333, "lng": -99.15}, # Bajío
-        "MMMY": {"lat": 21.0365, "lng": -86.8771}, # Cancún
-    }
-
     try:
-        token = obtener_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": "MiAppDeVuelos/1.0"
-        }
-        url = "https://opensky-network.org/api/flights/aircraft"
-        params = {
-            "icao24": icao24.lower(),
-            "begin": begin,
-            "end": now
-        }
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        resp.raise_for_status()
-        vuelos = resp.json()
+        ultimo_vuelo = _fetch_last_flight(icao24.lower(), now // 3600)
         
-        if not vuelos:
+        if not ultimo_vuelo:
             return jsonify({"error": "No hay vuelos recientes"}), 404
         
-        vuelo = vuelos[-1] # vuelo más reciente
-        origen = vuelo.get("estDepartureAirport")
-        destino = vuelo.get("estArrivalAirport")
+        origen, destino, callsign = ultimo_vuelo
         
         # Obtener el estado actual del vuelo de MongoDB (o simular)
         current_flight_state = {}
         if db is not None:
             current_flight_state = db.get_collection("flights").find_one({"icao24": icao24}) or {}
         
-        # Imprime para verificar en consola
-        print(f"Origen: {origen}, Destino: {destino}")
+        logger.debug("Origen: %s, Destino: %s", origen, destino)
         
-        origen_coords = aeropuertos.get(origen)
-        destino_coords = aeropuertos.get(destino)
+        origen_coords = AEROPUERTOS.get(origen)
+        destino_coords = AEROPUERTOS.get(destino)
 
         analysis = None
         audio_url = None
@@ -463,8 +980,8 @@ def ruta_vuelo(icao24):
         # 1. Llamar a Gemini con los datos combinados
         if gemini_service.is_available():
             flight_data_for_gemini = {
-                "callsign": vuelo.get("callsign", "N/A"),
-                "type": classify_flight(vuelo.get("callsign", "")),
+                "callsign": callsign or "N/A",
+                "type": classify_flight(callsign),
                 "origin_country": current_flight_state.get("pais_origen") or current_flight_state.get("origin_country"),
                 "altitude": current_flight_state.get("altitud") or current_flight_state.get("altitude"),
                 "velocity": current_flight_state.get("velocidad") or current_flight_state.get("velocity"),
@@ -479,22 +996,15 @@ def ruta_vuelo(icao24):
             if analysis and elevenlabs_service.is_available():
                 audio_data = elevenlabs_service.generate_alert_audio(analysis, alert_type="info")
                 
-                # Guardar el audio y generar la URL pública
+                # Audio embebido como data URL: lo reproduce cualquier cliente sin pedirlo a un
+                # worker concreto ni escribir en disco
                 if audio_data:
-                    static_dir = os.path.join(app.root_path, 'static')
-                    os.makedirs(static_dir, exist_ok=True)
-                    audio_filename = f"analysis_{icao24}.mp3"
-                    audio_filepath = os.path.join(static_dir, audio_filename)
-                    
-                    with open(audio_filepath, 'wb') as f:
-                        f.write(audio_data)
-                        
-                    audio_url = f"/static/{audio_filename}"
+                    audio_url = "data:audio/mpeg;base64," + base64.b64encode(audio_data).decode("ascii")
 
-        return jsonify({
+        return _json_response({
             "origen": origen_coords,
             "destino": destino_coords,
-            "callsign": vuelo.get("callsign", "N/A"),
+            "callsign": callsign or "N/A",
             "estDepartureAirport": origen,
             "estArrivalAirport": destino,
             "gemini_analysis": analysis,
@@ -504,39 +1014,60 @@ def ruta_vuelo(icao24):
     except requests.HTTPError as e:
         if e.response is not None and e.response.status_code == 404:
             return jsonify({"error": "Ruta no encontrada"}), 404
-        print(f"Error HTTP al consultar ruta: {e}")
+        logger.warning("Error HTTP al consultar ruta: %s", e)
         return jsonify({"error": "Error al consultar ruta"}), 500
     except Exception as e:
-        print(f"Error general en ruta_vuelo: {e}")
+        logger.exception("Error general en ruta_vuelo: %s", e)
         return jsonify({"error": "Error interno"}), 500
 
+MONGO_FIND_BATCH = 500
+
+# Campos que usa GeminiService.analyze_traffic_pattern
+TRAFFIC_ANALYSIS_PROJECTION = {
+    "_id": 0,
+    "callsign": 1,
+    "type": 1,
+    "origin_country": 1,
+    "altitude": 1,
+    "velocity": 1,
+}
+
+# Campos que el mapa necesita de cada vuelo almacenado
+FLIGHT_LIST_PROJECTION = {
+    "_id": 0,
+    "icao24": 1,
+    "callsign": 1,
+    "latitude": 1,
+    "longitude": 1,
+    "altitude": 1,
+    "velocity": 1,
+    "heading": 1,
+}
+
+
+def _filtered_vuelos_response(tipo):
+    """Vuelos en vivo de un tipo, filtrados de la entrada de caché de /vuelos (sin una segunda caché)."""
+    body = _dumps([v for v in obtener_vuelos() if v["type"] == tipo])
+    return _etag_json_response(body, hashlib.blake2b(body, digest_size=8).hexdigest(), RESPONSE_CACHE_TTL)
+
+
+def _stream_stored_by_type(tipo):
+    """Stream stored flights of a given type as a JSON array without building a list."""
+    # Sin hint: el planner ya elige {type, icao24}, y un hint a un índice ausente es un error
+    cursor = db.get_collection("flights").find(
+        {"type": tipo}, FLIGHT_LIST_PROJECTION
+    ).batch_size(MONGO_FIND_BATCH)
+    return _stream_cursor_response(cursor)
+
 @app.route('/vuelos/comerciales')
 def vuelos_comerciales():
     """Return commercial flights. Prefer stored data in MongoDB; otherwise call live API and filter."""
     try:
-        if db and db_client:
-            docs = db.get_collection("flights").find({"type": "comercial"})
-            return jsonify(list(docs)), 200
-
-        # fallback: call live /vuelos and filter
-        token = obtener_token()
-        url = "https://opensky-network.org/api/states/all"
-        params = {"lamin": LAT_MIN, "lomin": LON_MIN, "lamax": LAT_MAX, "lomax": LON_MAX}
-        headers = {"Authorization": f"Bearer {token}", "User-Agent": "MiAppDeVuelos/1.0"}
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        vuelos = []
-        for estado in data.get("states", []):
-            callsign = estado[1].strip() if estado[1] else ""
-            if classify_flight(callsign) == "comercial":
-                vuelos.append({
-                    "icao24": estado[0],
-                    "callsign": callsign,
-                    "latitude": estado[6],
-                    "longitude": estado[5],
-                })
-        return jsonify(vuelos), 200
+        if db is not None:
+            return _stream_stored_by_type("comercial")
+
+        # fallback: filter the live /vuelos list (same cache entry, same upstream call)
+        return _filtered_vuelos_response("comercial")
     except requests.HTTPError as e:
         logger.error(f"HTTP error in vuelos_comerciales: {e}")
         return jsonify({"error": "Error al consultar OpenSky"}), 500
@@ -548,29 +1079,11 @@ def vuelos_comerciales():
 def vuelos_carga():
     """Return cargo flights. Prefer stored data in MongoDB; otherwise call live API and filter."""
     try:
-        if db and db_client:
-            docs = db.get_collection("flights").find({"type": "carga"})
-            return jsonify(list(docs)), 200
-
-        # fallback: call live /vuelos and filter
-        token = obtener_token()
-        url = "https://opensky-network.org/api/states/all"
-        params = {"lamin": LAT_MIN, "lomin": LON_MIN, "lamax": LAT_MAX, "lomax": LON_MAX}
-        headers = {"Authorization": f"Bearer {token}", "User-Agent": "MiAppDeVuelos/1.0"}
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        vuelos = []
-        for estado in data.get("states", []):
-            callsign = estado[1].strip() if estado[1] else ""
-            if classify_flight(callsign) == "carga":
-                vuelos.append({
-                    "icao24": estado[0],
-                    "callsign": callsign,
-                    "latitude": estado[6],
-                    "longitude": estado[5],
-                })
-        return jsonify(vuelos), 200
+        if db is not None:
+            return _stream_stored_by_type("carga")
+
+        # fallback: filter the live /vuelos list (same cache entry, same upstream call)
+        return _filtered_vuelos_response("carga")
     except requests.HTTPError as e:
         logger.error(f"HTTP error in vuelos_carga: {e}")
         return jsonify({"error": "Error al consultar OpenSky"}), 500
@@ -586,8 +1099,8 @@ def analyze_flight(icao24):
             return jsonify({"error": "Servicio de análisis no disponible. Configura GEMINI_API_KEY."}), 503
         
         # Buscar el vuelo en los datos actuales
-        if db and db_client:
-            flight = db.get_collection("flights").find_one({"icao24": icao24})
+        if db is not None:
+            flight = db.get_collection("flights").find_one({"icao24": icao24}, {"_id": 0})
         else:
             return jsonify({"error": "Base de datos no disponible"}), 503
         
@@ -617,8 +1130,10 @@ def analyze_traffic():
             return jsonify({"error": "Servicio de análisis no disponible. Configura GEMINI_API_KEY."}), 503
         
         # Obtener vuelos actuales
-        if db and db_client:
-            flights = list(db.get_collection("flights").find())
+        if db is not None:
+            flights = list(
+                db.get_collection("flights").find({}, TRAFFIC_ANALYSIS_PROJECTION).batch_size(MONGO_FIND_BATCH)
+            )
         else:
             # Fallback: llamar al endpoint de vuelos
             return jsonify({"error": "Base de datos no disponible"}), 503
@@ -661,13 +1176,15 @@ def chat():
         
         # Obtener contexto actual
         context = {}
-        if db and db_client:
-            flights = list(db.get_collection("flights").find())
+        if db is not None:
+            flights = list(
+                db.get_collection("flights").find({}, {"_id": 0, "type": 1}).batch_size(MONGO_FIND_BATCH)
+            )
             context = {
                 "total_flights": len(flights),
                 "commercial_flights": sum(1 for f in flights if f.get('type') == 'comercial'),
                 "cargo_flights": sum(1 for f in flights if f.get('type') == 'carga'),
-                "recent_alerts": len(alerts_history[-10:]),
+                "recent_alerts": min(len(alerts_history), 10),
                 "last_update": time.strftime('%Y-%m-%d %H:%M:%S')
             }
         
@@ -683,32 +1200,91 @@ def chat():
         logger.error(f"Error en chat: {e}")
         return jsonify({"error": "Error interno"}), 500
 
-@app.route("/analyze/predict", methods=['GET'])
-def analyze_predict():
-    """Análisis predictivo de patrones de tráfico usando datos históricos y Gemini"""
-    try:
-        if not gemini_service.is_available():
-            return jsonify({
-                "error": "Análisis predictivo no disponible. Gemini API no configurada.",
-                "timestamp": int(time.time()),
-                "data_points": 0
-            }), 503
-        
-        # Obtener datos históricos de las últimas 24 horas
-        if db and db_client:
-            historical_data = list(db.get_collection("historical_data").find({"timestamp": {"$gte": now - 24*3600}}))
-            data_points = len(historical_data)
-        else:
-            # Si no hay MongoDB, usar datos actuales con múltiples muestras
-            historical_data = []
-            data_points = 0
-            logger.warning("MongoDB no disponible. Análisis predictivo limitado.")
-        
-        # Obtener datos actuales
-        current_flights = obtener_vuelos()
-        
-        # Preparar análisis para Gemini
-        analysis_prompt = f"""
+
+def _hourly_averages(since):
+    """Promedios por hora local de los snapshots de historical_data desde `since`.
+
+    La agregación corre en Mongo y devuelve una fila por hora (≤24) en vez de todos
+    los snapshots con sus vuelos. Devuelve ({"HH": {avg_total, avg_cargo,
+    avg_commercial}} en orden cronológico, número de snapshots).
+    """
+    def count_type(tipo):
+        return {"$size": {"$filter": {"input": {"$ifNull": ["$flights", []]}, "cond": {"$eq": ["$$this.type", tipo]}}}}
+
+    rows = db.historical_data.aggregate([
+        {"$match": {"timestamp": {"$gte": since}}},
+        {"$project": {
+            "timestamp": 1,
+            "hour": {"$dateToString": {
+                "format": "%H",
+                "date": {"$toDate": {"$multiply": ["$timestamp", 1000]}},
+                "timezone": time.strftime("%z"),
+            }},
+            "total": {"$size": {"$ifNull": ["$flights", []]}},
+            "cargo": count_type("carga"),
+            "commercial": count_type("comercial"),
+        }},
+        {"$group": {
+            "_id": "$hour",
+            "first_ts": {"$min": "$timestamp"},
+            "count": {"$sum": 1},
+            "avg_total": {"$avg": "$total"},
+            "avg_cargo": {"$avg": "$cargo"},
+            "avg_commercial": {"$avg": "$commercial"},
+        }},
+        {"$sort": {"first_ts": 1}},
+    ])
+    avg_by_hour = {}
+    data_points = 0
+    for row in rows:
+        data_points += row["count"]
+        avg_by_hour[row["_id"]] = {
+            "avg_total": row["avg_total"],
+            "avg_cargo": row["avg_cargo"],
+            "avg_commercial": row["avg_commercial"],
+        }
+    return avg_by_hour, data_points
+
+
+PREDICT_CACHE_TTL = 60
+# Pool propio para la agregación de predict: no compite con las escrituras de EXECUTOR.
+# Un hilo basta porque el lock de la caché solo deja construir una predicción a la vez
+_PREDICT_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ghostflight-predict")
+
+# Secciones de la respuesta estructurada de /analyze/predict (clave JSON, título mostrado)
+PREDICTION_SECTIONS = (
+    ("traffic_prediction", "PREDICCIÓN DE TRÁFICO"),
+    ("peak_hours", "HORARIOS PICO ESPERADOS"),
+    ("cargo_trend", "TENDENCIAS DE CARGA"),
+    ("recommendations", "RECOMENDACIONES OPERATIVAS"),
+    ("confidence", "NIVEL DE CONFIANZA"),
+)
+PREDICTION_SCHEMA = {
+    "type": "object",
+    "properties": {clave: {"type": "string"} for clave, _ in PREDICTION_SECTIONS},
+    "required": [clave for clave, _ in PREDICTION_SECTIONS],
+}
+
+
+def _build_prediction():
+    """Construye el prompt predictivo y consulta a Gemini (se cachea PREDICT_CACHE_TTL)."""
+    # La agregación de Mongo corre en su propio hilo mientras este pide los vuelos actuales;
+    # así un /vuelos expirado (con sus alertas y escrituras) se refresca en el hilo de la petición
+    if db is not None:
+        history_future = _PREDICT_POOL.submit(_hourly_averages, int(time.time()) - 24*3600)
+    else:
+        # Si no hay MongoDB, usar datos actuales con múltiples muestras
+        history_future = None
+        logger.warning("MongoDB no disponible. Análisis predictivo limitado.")
+    
+    # Obtener datos actuales
+    current_flights = obtener_vuelos()
+    
+    # Obtener datos históricos de las últimas 24 horas, ya agregados por hora en Mongo
+    avg_by_hour, data_points = history_future.result() if history_future is not None else ({}, 0)
+    
+    # Preparar análisis para Gemini
+    analysis_prompt = f"""
 Eres un experto en análisis de tráfico aéreo y predicción de patrones.
 
 DATOS ACTUALES:
@@ -721,86 +1297,85 @@ DATOS HISTÓRICOS:
 - Puntos de datos disponibles: {data_points}
 """
 
-        if data_points > 0:
-            # Análisis por hora
-            hourly_stats = {}
-            for record in historical_data:
-                hour = time.strftime('%H', time.localtime(record['timestamp']))
-                if hour not in hourly_stats:
-                    hourly_stats[hour] = {'total': 0, 'cargo': 0, 'commercial': 0, 'count': 0}
-                
-                flights = record.get('flights', [])
-                hourly_stats[hour]['total'] += len(flights)
-                hourly_stats[hour]['cargo'] += sum(1 for f in flights if f.get('type') == 'carga')
-                hourly_stats[hour]['commercial'] += sum(1 for f in flights if f.get('type') == 'comercial')
-                hourly_stats[hour]['count'] += 1
-            
-            # Calcular promedios
-            avg_by_hour = {}
-            for hour, stats in hourly_stats.items():
-                if stats['count'] > 0:
-                    avg_by_hour[hour] = {
-                        'avg_total': stats['total'] / stats['count'],
-                        'avg_cargo': stats['cargo'] / stats['count'],
-                        'avg_commercial': stats['commercial'] / stats['count']
-                    }
-            
-            analysis_prompt += f"\n\nPATRONES HORARIOS (últimas 24h):\n"
-            for hour in sorted(avg_by_hour.keys()):
-                stats = avg_by_hour[hour]
-                analysis_prompt += f"- {hour}:00 - Promedio: {stats['avg_total']:.1f} vuelos (Carga: {stats['avg_cargo']:.1f}, Comercial: {stats['avg_commercial']:.1f})\n"
-            
-            # Detectar horas pico
-            peak_hours = sorted(avg_by_hour.items(), key=lambda x: x[1]['avg_total'], reverse=True)[:3]
-            analysis_prompt += f"\n\nHORAS PICO DETECTADAS:\n"
-            for hour, stats in peak_hours:
-                analysis_prompt += f"- {hour}:00 con promedio de {stats['avg_total']:.1f} vuelos\n"
-            
-            # Tendencias de carga
-            cargo_by_hour = [(hour, stats['avg_cargo']) for hour, stats in avg_by_hour.items()]
-            cargo_trend = "creciente" if len(cargo_by_hour) > 1 and cargo_by_hour[-1][1] > cargo_by_hour[0][1] else "decreciente"
-            analysis_prompt += f"\n\nTENDENCIA DE VUELOS DE CARGA: {cargo_trend}\n"
+    if data_points > 0:
+        analysis_prompt += f"\n\nPATRONES HORARIOS (últimas 24h):\n"
+        for hour in sorted(avg_by_hour.keys()):
+            stats = avg_by_hour[hour]
+            analysis_prompt += f"- {hour}:00 - Promedio: {stats['avg_total']:.1f} vuelos (Carga: {stats['avg_cargo']:.1f}, Comercial: {stats['avg_commercial']:.1f})\n"
         
-        analysis_prompt += """
+        # Detectar horas pico
+        peak_hours = sorted(avg_by_hour.items(), key=lambda x: x[1]['avg_total'], reverse=True)[:3]
+        analysis_prompt += f"\n\nHORAS PICO DETECTADAS:\n"
+        for hour, stats in peak_hours:
+            analysis_prompt += f"- {hour}:00 con promedio de {stats['avg_total']:.1f} vuelos\n"
+        
+        # Tendencias de carga
+        cargo_by_hour = [(hour, stats['avg_cargo']) for hour, stats in avg_by_hour.items()]
+        cargo_trend = "creciente" if len(cargo_by_hour) > 1 and cargo_by_hour[-1][1] > cargo_by_hour[0][1] else "decreciente"
+        analysis_prompt += f"\n\nTENDENCIA DE VUELOS DE CARGA: {cargo_trend}\n"
+    
+    analysis_prompt += """
 
 TAREA:
 Proporciona un análisis predictivo detallado que incluya:
 
-1. PREDICCIÓN DE TRÁFICO (próximas horas):
+1. traffic_prediction - PREDICCIÓN DE TRÁFICO (próximas horas):
    - ¿Se espera aumento o disminución del tráfico?
    - ¿Cuántos vuelos se anticipan aproximadamente?
 
-2. HORARIOS PICO ESPERADOS:
+2. peak_hours - HORARIOS PICO ESPERADOS:
    - ¿Cuáles serán las próximas horas de mayor tráfico?
    - Justifica basándote en los patrones históricos
 
-3. TENDENCIAS DE CARGA:
+3. cargo_trend - TENDENCIAS DE CARGA:
    - ¿Cómo evolucionarán los vuelos de carga?
    - ¿Hay patrones específicos a considerar?
 
-4. RECOMENDACIONES OPERATIVAS:
+4. recommendations - RECOMENDACIONES OPERATIVAS:
    - ¿Qué acciones se sugieren para el monitoreo?
    - ¿Hay algún patrón anómalo o preocupante?
 
-5. NIVEL DE CONFIANZA:
+5. confidence - NIVEL DE CONFIANZA:
    - Evalúa la confiabilidad de tu predicción (Alta/Media/Baja)
    - Justifica tu evaluación
 
-Responde de manera clara, profesional y estructurada. Usa datos específicos cuando sea posible.
+Responde con un objeto JSON con esas cinco claves; cada valor es un texto claro y profesional.
+Usa datos específicos cuando sea posible.
 """
 
-        # Solicitar análisis a Gemini
-        prediction = gemini_service.generate_response(analysis_prompt)
+    # Una sola llamada con salida JSON estructurada (sin extraer JSON del texto)
+    prediction = gemini_service.generate_json(analysis_prompt, PREDICTION_SCHEMA)
+    if prediction is None:
+        # No se cachea un fallo: la siguiente petición vuelve a intentarlo
+        raise RuntimeError("Gemini no devolvió ningún análisis")
+    # El mapa muestra raw_analysis como texto
+    prediction["raw_analysis"] = "\n\n".join(
+        f"{titulo}:\n{prediction[clave]}" for clave, titulo in PREDICTION_SECTIONS if prediction.get(clave)
+    )
+
+    return {
+        "prediction": prediction,
+        "timestamp": int(time.time()),
+        "data_points": data_points,
+        "current_flights": len(current_flights),
+        "has_historical_data": data_points > 0
+    }
+
+
+@app.route("/analyze/predict", methods=['GET'])
+def analyze_predict():
+    """Análisis predictivo de patrones de tráfico usando datos históricos y Gemini"""
+    try:
+        if not gemini_service.is_available():
+            return jsonify({
+                "error": "Análisis predictivo no disponible. Gemini API no configurada.",
+                "timestamp": int(time.time()),
+                "data_points": 0
+            }), 503
         
-        return jsonify({
-            "prediction": {
-                "raw_analysis": prediction
-            },
-            "timestamp": int(time.time()),
-            "data_points": data_points,
-            "current_flights": len(current_flights),
-            "has_historical_data": data_points > 0
-        })
+        # El análisis depende de agregados horarios y de la llamada a Gemini; se reutiliza
+        # durante PREDICT_CACHE_TTL en vez de repetirlo en cada petición
+        return _cached_json_response(("predict",), _build_prediction, ttl=PREDICT_CACHE_TTL)
         
     except Exception as e:
         logger.error(f"Error en análisis predictivo: {e}")
@@ -813,44 +1388,55 @@ Responde de manera clara, profesional y estructurada. Usa datos específicos cua
 @app.route("/alerts/<int:alert_id>/audio")
 def get_alert_audio(alert_id):
     """Genera y devuelve audio para una alerta específica"""
-    from flask import Response
-    
     try:
         if not elevenlabs_service.is_available():
             return jsonify({"error": "Servicio de voz no disponible. Configura ELEVENLABS_API_KEY."}), 503
         
         # Buscar la alerta
-        alert = next((a for a in alerts_history if a.get('id') == alert_id), None)
+        alert = alerts_by_id.get(alert_id)
+        if alert is None and db is not None:
+            # La alerta pudo generarse en otro worker
+            alert = db.alerts.find_one({"id": alert_id}, {"_id": 0})
         
         if not alert:
             return jsonify({"error": "Alerta no encontrada"}), 404
         
         # Crear narración
         narration = elevenlabs_service.create_alert_narration(alert)
+        severity = alert.get('severity', 'info')
         
-        # Generar audio
-        audio_data = elevenlabs_service.generate_alert_audio(
-            narration, 
-            alert.get('severity', 'info')
-        )
-        
-        if audio_data:
-            return Response(
+        # El texto de una alerta no cambia: el audio se reutiliza y el navegador puede revalidar
+        audio_key = hashlib.sha1(f"{narration}|{severity}".encode("utf-8")).hexdigest()
+        if request.if_none_match.contains(audio_key):
+            response = Response(status=304)
+        else:
+            audio_data = _AUDIO_CACHE.get(audio_key)
+            if audio_data is None:
+                # Generar audio
+                audio_data = elevenlabs_service.generate_alert_audio(narration, severity)
+                if not audio_data:
+                    return jsonify({"error": "Error al generar audio"}), 500
+                _store_audio(audio_key, audio_data)
+            response = Response(
                 audio_data,
                 mimetype="audio/mpeg",
                 headers={"Content-Disposition": f"attachment;filename=alert_{alert_id}.mp3"}
             )
-        else:
-            return jsonify({"error": "Error al generar audio"}), 500
+        response.set_etag(audio_key)
+        response.headers["Cache-Control"] = f"public, max-age={AUDIO_MAX_AGE}"
+        return response
             
     except Exception as e:
         logger.error(f"Error en get_alert_audio: {e}")
         return jsonify({"error": "Error interno"}), 500
 
+AI_STATUS_MAX_AGE = 10
+
+
 @app.route("/ai/status")
 def ai_status():
     """Retorna el estado de los servicios de IA"""
-    return jsonify({
+    body = _dumps({
         "gemini": {
             "available": gemini_service.is_available(),
             "configured": gemini_service.api_key is not None
@@ -859,62 +1445,25 @@ def ai_status():
             "available": elevenlabs_service.is_available(),
             "configured": elevenlabs_service.api_key is not None
         }
-    }), 200
+    })
+    # Casi estático: el mapa lo consulta a menudo y puede revalidar con If-None-Match
+    return _etag_json_response(body, hashlib.blake2b(body, digest_size=8).hexdigest(), AI_STATUS_MAX_AGE)
 
-def obtener_vuelos():
-    url = "https://opensky-network.org/api/states/all"
-    params = {
-        "lamin": LAT_MIN,
-        "lomin": LON_MIN,
-        "lamax": LAT_MAX,
-        "lomax": LON_MAX
-    }
-    
-    try:
-        token = obtener_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": "MiAppDeVuelos/1.0"
-        }
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        vuelos = []
-        now_ts = int(time.time())
-        for estado in data.get("states", []):
-            lat = estado[6]
-            lon = estado[5]
-            if lat is None or lon is None:
-                continue
 
-            callsign = estado[1].strip() if estado[1] else ""
-            tipo = classify_flight(callsign)
+@app.route("/cache/status")
+def cache_status():
+    """Contadores de la caché de /vuelos; cambian en cada petición, así que no se cachean"""
+    with _cache_stats_lock:
+        stats = dict(response_cache_stats.get(VUELOS_CACHE_KEY, {"hits": 0, "misses": 0}))
+    response = _json_response({"ttl": RESPONSE_CACHE_TTL, **stats})
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
-            vuelo = {
-                "icao24": estado[0],
-                "callsign": callsign if callsign else "N/A",
-                "origin_country": estado[2],
-                "latitude": lat,
-                "longitude": lon,
-                "altitude": estado[7],
-                "velocity": estado[9],
-                "heading": estado[10],
-                "type": tipo,
-                "fetched_at": now_ts,
-            }
-            vuelos.append(vuelo)
-        
-        return vuelos
-    
-    except requests.HTTPError as e:
-        if e.response is not None and e.response.status_code == 429:
-            return jsonify({"error": "Límite de peticiones alcanzado. Intenta más tarde."}), 429
-        print(f"Error HTTP al consultar OpenSky: {e}")
-        return jsonify({"error": "Error al consultar OpenSky"}), 500
-    except Exception as e:
-        print(f"Error general: {e}")
-        return jsonify({"error": "Error interno"}), 500
+def obtener_vuelos():
+    """Vuelos en BBOX ya clasificados, compartiendo caché y llamada a OpenSky con /vuelos."""
+    return _cached_json(VUELOS_CACHE_KEY, _refresh_vuelos)[2]
 
 if __name__ == "__main__":
+    # Servidor de desarrollo (un solo hilo, con recarga). En producción usar wsgi.py con gunicorn.
+    start_token_refresher()
     app.run(debug=True)
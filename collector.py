@@ -1,16 +1,20 @@
 #!/usr/bin/env python3
 
 import time
+import queue
 import signal
+import threading
+from datetime import datetime, timedelta, timezone
 import sys
 import logging
 from typing import Optional
-from app import obtener_token, classify_flight, MONGODB_URI
+from app import SESSION, obtener_token, classify_flight, MONGODB_URI, _iter_states
 
 try:
-    from pymongo import MongoClient
+    from pymongo import MongoClient, UpdateOne
 except Exception:
     MongoClient = None
+    UpdateOne = None
 
 import requests
 import os
@@ -20,8 +24,18 @@ logger = logging.getLogger("colector")
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 
 # Variables globales
-RUNNING = True
+APAGADO = threading.Event()
 INTERVALO = int(os.environ.get("COLLECT_INTERVAL", "15"))  # segundos
+# Cola de escrituras: el ciclo de OpenSky solo encola y un hilo escritor vacía en lotes
+LOTE_ESCRITURA = 500
+WRITE_Q = queue.Queue(maxsize=10000)
+# Vuelos que el colector no ha visto en este tiempo se borran (ya salieron del área)
+RETENCION = int(os.environ.get("COLLECT_RETENTION", "300"))  # segundos
+# Solo se escriben los vuelos que cambiaron desde el ciclo anterior; cada
+# RESINCRONIZACION se reescriben todos (antes de que la purga los considere obsoletos)
+RESINCRONIZACION = RETENCION // 2
+estados_previos = {}
+ultima_resincronizacion = 0
 
 # Límites geográficos aproximados (México y alrededores)
 LAT_MIN = 14.0
@@ -32,25 +46,28 @@ LON_MAX = -86.0
 # Conexión con MongoDB
 cliente = None
 db = None
+coleccion_vuelos = None
 if MONGODB_URI and MongoClient is not None:
     try:
         cliente = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
         cliente.server_info()
         db = cliente.get_default_database()
+        coleccion_vuelos = db.get_collection("flights")
+        # Los índices (icao24 único, last_seen para la purga) los crea app.py al importarse
         logger.info("✅ Conectado a MongoDB correctamente.")
     except Exception as e:
         logger.warning(f"⚠️ No se pudo conectar a MongoDB: {e}")
         cliente = None
         db = None
+        coleccion_vuelos = None
 else:
     if MONGODB_URI and MongoClient is None:
         logger.warning("⚠️ pymongo no está instalado; el colector no podrá guardar datos.")
 
 
 def apagar(signum, frame):
-    global RUNNING
     logger.info("🛑 Deteniendo el colector...")
-    RUNNING = False
+    APAGADO.set()
 
 
 signal.signal(signal.SIGINT, apagar)
@@ -58,7 +75,7 @@ signal.signal(signal.SIGTERM, apagar)
 
 
 def obtener_estados():
-    """Obtiene los datos de vuelos desde OpenSky API."""
+    """Genera los state vectors de OpenSky a medida que llegan, sin cargar el JSON completo."""
     token = obtener_token()
     url = "https://opensky-network.org/api/states/all"
     params = {
@@ -68,22 +85,32 @@ def obtener_estados():
         "lomax": LON_MAX,
     }
     headers = {"Authorization": f"Bearer {token}", "User-Agent": "Colector/1.0"}
-    resp = requests.get(url, headers=headers, params=params, timeout=15)
-    resp.raise_for_status()
-    return resp.json()
+    # Sesión compartida con app.py: conexión keep-alive y reintentos ante 429/5xx
+    with SESSION.get(url, headers=headers, params=params, timeout=15, stream=True) as resp:
+        resp.raise_for_status()
+        yield from _iter_states(resp)
 
 
-def procesar_y_guardar(estados_json: dict):
-    """Procesa los datos de los vuelos y los guarda en MongoDB."""
+def procesar_y_guardar(estados):
+    """Procesa los datos de los vuelos y guarda en MongoDB los que cambiaron."""
+    global ultima_resincronizacion
+    if coleccion_vuelos is None:
+        return
     marca_tiempo = int(time.time())
-    estados = estados_json.get("states", [])
+    if marca_tiempo - ultima_resincronizacion >= RESINCRONIZACION:
+        estados_previos.clear()
+        ultima_resincronizacion = marca_tiempo
+    operaciones = []
     for estado in estados:
         icao24 = estado[0]
-        callsign = estado[1].strip() if estado[1] else ""
         lat = estado[6]
         lon = estado[5]
         if lat is None or lon is None:
             continue
+        firma = (estado[1], lon, lat, estado[7], estado[9], estado[10])
+        if estados_previos.get(icao24) == firma:
+            continue
+        callsign = estado[1].strip() if estado[1] else ""
         tipo = classify_flight(callsign)
         doc = {
             "icao24": icao24,
@@ -97,35 +124,91 @@ def procesar_y_guardar(estados_json: dict):
             "tipo": tipo,
             "fecha_captura": marca_tiempo,
         }
-        if db is not None:
-            try:
-                coleccion = db.get_collection("flights")
-                coleccion.update_one(
-                    {"icao24": icao24},
-                    {"$set": doc, "$currentDate": {"ultima_actualizacion": True}},
-                    upsert=True
-                )
-            except Exception as e:
-                logger.warning(f"⚠️ Error al escribir en la base de datos para {icao24}: {e}")
+        operaciones.append((icao24, firma, UpdateOne(
+            {"icao24": icao24},
+            # Mismo campo de frescura que escribe app.py, para que la purga cubra ambos
+            {"$set": doc, "$currentDate": {"last_seen": True}},
+            upsert=True
+        )))
+
+    # La escritura la hace el hilo escritor; si Mongo va lento no se retrasa el siguiente ciclo
+    # La firma se registra cuando el escritor confirma la escritura, no al encolar
+    for i, item in enumerate(operaciones):
+        try:
+            WRITE_Q.put_nowait(item)
+        except queue.Full:
+            logger.warning(f"⚠️ Cola de escritura llena; se descartan {len(operaciones) - i} vuelos de este ciclo")
+            break
+
+
+def _tomar_lote():
+    """Espera hasta 1 s por la primera operación y junta hasta LOTE_ESCRITURA sin bloquear."""
+    lote = [WRITE_Q.get(timeout=1)]
+    while len(lote) < LOTE_ESCRITURA:
+        try:
+            lote.append(WRITE_Q.get_nowait())
+        except queue.Empty:
+            break
+    return lote
+
+
+def _escribir_lote(lote):
+    """Escribe un lote de (icao24, firma, UpdateOne) y recuerda las firmas de lo escrito."""
+    # Un solo viaje a MongoDB por lote en lugar de un update_one por vuelo
+    try:
+        coleccion_vuelos.bulk_write([op for _, _, op in lote], ordered=False)
+        for icao24, firma, _ in lote:
+            estados_previos[icao24] = firma
+    except Exception as e:
+        # Sin firma registrada, el siguiente ciclo vuelve a encolar estos vuelos
+        logger.warning(f"⚠️ Error al escribir {len(lote)} vuelos en la base de datos: {e}")
+    finally:
+        for _ in lote:
+            WRITE_Q.task_done()
+
+
+def _purgar_obsoletos():
+    # Los documentos se actualizan en sitio; solo se eliminan los que dejaron de aparecer
+    limite = datetime.now(timezone.utc) - timedelta(seconds=RETENCION)
+    try:
+        coleccion_vuelos.delete_many({"$or": [
+            {"last_seen": {"$lt": limite}},
+            # Documentos escritos por versiones anteriores del colector
+            {"last_seen": {"$exists": False}, "ultima_actualizacion": {"$lt": limite}},
+        ]})
+    except Exception as e:
+        logger.warning(f"⚠️ Error al purgar vuelos obsoletos: {e}")
+
+
+def _escritor():
+    ultima_purga = time.time()
+    while True:
+        try:
+            _escribir_lote(_tomar_lote())
+        except queue.Empty:
+            pass
+        if time.time() - ultima_purga >= INTERVALO:
+            _purgar_obsoletos()
+            ultima_purga = time.time()
 
 
 def main():
     logger.info(f"🚀 Iniciando colector (intervalo = {INTERVALO}s)")
-    global RUNNING
-    while RUNNING:
+    if coleccion_vuelos is not None:
+        threading.Thread(target=_escritor, name="colector-escritor", daemon=True).start()
+    while not APAGADO.is_set():
         try:
-            datos = obtener_estados()
-            procesar_y_guardar(datos)
+            procesar_y_guardar(obtener_estados())
         except requests.HTTPError as e:
             logger.error(f"❌ Error HTTP al obtener los estados: {e}")
         except Exception as e:
             logger.exception(f"💥 Error inesperado en el ciclo del colector: {e}")
-        # Esperar el siguiente ciclo
-        dormido = 0
-        while RUNNING and dormido < INTERVALO:
-            time.sleep(1)
-            dormido += 1
+        # Esperar el siguiente ciclo; la señal de apagado despierta la espera al instante
+        APAGADO.wait(INTERVALO)
 
+    if coleccion_vuelos is not None:
+        # Vaciar lo pendiente antes de salir
+        WRITE_Q.join()
     logger.info("✅ Colector detenido correctamente.")
 
 
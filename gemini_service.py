@@ -141,6 +141,19 @@ Si necesitas más información para responder, indícalo claramente."""
             logger.error(f"Error al generar respuesta con Gemini: {e}")
             return None
     
+    def generate_json(self, prompt: str, schema: Optional[Dict] = None) -> Optional[Dict]:
+        """Genera una respuesta estructurada: Gemini devuelve JSON directamente (opcionalmente validado con `schema`)"""
+        if not self.is_available():
+            return None
+        
+        try:
+            config = genai.GenerationConfig(response_mime_type="application/json", response_schema=schema)
+            response = self.model.generate_content(prompt, generation_config=config)
+            return json.loads(response.text)
+        except Exception as e:
+            logger.error(f"Error al generar respuesta JSON con Gemini: {e}")
+            return None
+    
     def predict_pattern(self, historical_data: List[Dict]) -> Optional[Dict]:
         """Analiza datos históricos y predice patrones futuros"""
         if not self.is_available():
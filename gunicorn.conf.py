@@ -0,0 +1,10 @@
+import multiprocessing
+import os
+
+# Todos los endpoints esperan en HTTP externo (OpenSky, Gemini, ElevenLabs),
+# así que usamos workers gevent para solapar esas esperas.
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_connections = 1000
+timeout = 30
@@ -0,0 +1,83 @@
+import unittest
+from unittest import mock
+
+import app
+
+
+class TestCheckAlerts(unittest.TestCase):
+    def setUp(self):
+        app.alerts_history.clear()
+        app.alerts_by_id.clear()
+        app._recent_alert_keys.clear()
+        app.seen_cargo_flights.clear()
+
+    def _low(self, icao24):
+        return {"icao24": icao24, "callsign": "AAL1", "type": "comercial", "altitude": 100, "velocity": 100}
+
+    def test_low_altitude_deduplicated_within_cooldown(self):
+        with mock.patch("app.time.time", return_value=1000.0):
+            first = app.check_alerts([self._low("abc123")])
+            second = app.check_alerts([self._low("abc123")])
+        self.assertEqual([a["type"] for a in first], ["low_altitude"])
+        self.assertEqual(second, [])
+        with mock.patch("app.time.time", return_value=1000.0 + app.ALERT_COOLDOWN):
+            third = app.check_alerts([self._low("abc123")])
+        self.assertEqual([a["type"] for a in third], ["low_altitude"])
+
+    def test_history_keeps_last_100(self):
+        with mock.patch("app.time.time", return_value=1000.0):
+            app.check_alerts([self._low(f"icao{i}") for i in range(150)])
+        self.assertEqual(len(app.alerts_history), 100)
+        self.assertEqual(app.alerts_history[-1]["flight_data"]["icao24"], "icao149")
+
+    def test_index_follows_history_eviction(self):
+        alerts = [{"id": i, "type": "test"} for i in range(app.alerts_history.maxlen + 5)]
+        app._record_alerts(alerts)
+        self.assertEqual(len(app.alerts_by_id), app.alerts_history.maxlen)
+        self.assertNotIn(0, app.alerts_by_id)
+        self.assertIs(app.alerts_by_id[alerts[-1]["id"]], alerts[-1])
+
+
+class TestAlertsEndpoints(unittest.TestCase):
+    def setUp(self):
+        app.alerts_history.clear()
+        app.alerts_by_id.clear()
+        app._pending_alert_keys.clear()
+        self.client = app.app.test_client()
+        self.db = mock.MagicMock()
+        patcher = mock.patch.object(app, "db", self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_merges_alerts_not_yet_persisted(self):
+        stored = {"id": 1, "type": "test", "timestamp": 100}
+        pending = {"id": 2, "type": "test", "timestamp": 200}
+        app._record_alerts([dict(stored), pending])
+        app._pending_alert_keys.add(app._alert_key(pending))
+        self.db.alerts.find.return_value.sort.return_value.limit.return_value = [stored]
+        resp = self.client.get("/alerts")
+        self.assertEqual([a["id"] for a in resp.get_json()], [1, 2])
+
+    def test_get_does_not_resurrect_alerts_cleared_elsewhere(self):
+        # Otro worker vació Mongo; las alertas locales ya escritas no deben reaparecer
+        app._record_alerts([{"id": 1, "type": "test", "timestamp": 100}])
+        self.db.alerts.find.return_value.sort.return_value.limit.return_value = []
+        resp = self.client.get("/alerts")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_store_forgets_pending_even_on_failure(self):
+        alert = {"id": 3, "type": "test", "timestamp": 300}
+        app._pending_alert_keys.add(app._alert_key(alert))
+        self.db.alerts.insert_many.side_effect = Exception("atlas down")
+        app._store_alerts([alert])
+        self.assertEqual(app._pending_alert_keys, set())
+
+    def test_clear_keeps_capped_collection(self):
+        resp = self.client.post("/alerts/clear")
+        self.assertEqual(resp.status_code, 200)
+        self.db.alerts.delete_many.assert_called_once_with({})
+        self.db.alerts.drop.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+import app
+
+
+class TestRouteAudio(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+        patches = [
+            mock.patch.object(app, "db", None),
+            mock.patch.object(app, "_fetch_last_flight", return_value=("MMMX", "MMUN", "AMX200")),
+            mock.patch.object(app.gemini_service, "is_available", return_value=True),
+            mock.patch.object(app.gemini_service, "analyze_flight_pattern", return_value="normal"),
+            mock.patch.object(app.elevenlabs_service, "is_available", return_value=True),
+            mock.patch.object(app.elevenlabs_service, "generate_alert_audio", return_value=b"ID3fake"),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_audio_is_inlined_so_any_worker_can_serve_it(self):
+        data = self.client.get("/ruta_vuelo/ABC123").get_json()
+        self.assertEqual(data["audio_url"], "data:audio/mpeg;base64,SUQzZmFrZQ==")
+
+
+class TestAudioCache(unittest.TestCase):
+    def setUp(self):
+        app._AUDIO_CACHE.clear()
+
+    def test_evicts_oldest_entry(self):
+        with mock.patch.object(app, "AUDIO_CACHE_MAX", 2):
+            for key in ("a", "b", "c"):
+                app._store_audio(key, b"x")
+        self.assertEqual(list(app._AUDIO_CACHE), ["b", "c"])
+
+
+class TestAlertAudio(unittest.TestCase):
+    ALERT = {"id": 7, "type": "cargo_entry", "severity": "info", "message": "FDX1 entró"}
+
+    def setUp(self):
+        app._AUDIO_CACHE.clear()
+        app.alerts_history.clear()
+        app.alerts_by_id.clear()
+        app._record_alerts([dict(self.ALERT)])
+        self.addCleanup(app.alerts_history.clear)
+        self.addCleanup(app.alerts_by_id.clear)
+        self.client = app.app.test_client()
+        patcher = mock.patch.object(app.elevenlabs_service, "is_available", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generates_once_and_revalidates_with_etag(self):
+        with mock.patch.object(app.elevenlabs_service, "create_alert_narration", return_value="Alerta"), \
+                mock.patch.object(app.elevenlabs_service, "generate_alert_audio", return_value=b"ID3") as gen:
+            first = self.client.get("/alerts/7/audio")
+            second = self.client.get("/alerts/7/audio")
+            third = self.client.get("/alerts/7/audio", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(gen.call_count, 1)
+        self.assertEqual(first.data, b"ID3")
+        self.assertEqual(second.data, b"ID3")
+        self.assertEqual(third.status_code, 304)
+        self.assertEqual(first.headers["Cache-Control"], f"public, max-age={app.AUDIO_MAX_AGE}")
+
+
+if __name__ == '__main__':
+    unittest.main()
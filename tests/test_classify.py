@@ -1,5 +1,6 @@
 import unittest
-from app import classify_flight
+import app
+from app import classify_flight, _build_prefix_index
 
 
 class TestClassifyFlight(unittest.TestCase):
@@ -20,6 +21,46 @@ class TestClassifyFlight(unittest.TestCase):
         # Unknown prefixes default to comercial in our heuristic
         self.assertEqual(classify_flight("ZZZ123"), "comercial")
 
+    def test_whitespace_and_case(self):
+        self.assertEqual(classify_flight("  fdx12 "), "carga")
+
+    def test_cache_is_keyed_on_prefix(self):
+        app._classify_cached.cache_clear()
+        classify_flight("AAL100")
+        classify_flight("AAL200")
+        info = app._classify_cached.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def test_reload_operator_map_invalidates_cache(self):
+        original = app.OPERATOR_MAP
+        self.assertEqual(classify_flight("ABX123"), "comercial")
+        try:
+            app.reload_operator_map({"cargo_prefixes": ["abx"], "commercial_prefixes": []})
+            self.assertEqual(classify_flight("ABX123"), "carga")
+        finally:
+            app.reload_operator_map(original)
+        self.assertEqual(classify_flight("ABX123"), "comercial")
+
+    def test_reload_operator_map_normalizes_case(self):
+        original = app.OPERATOR_MAP
+        try:
+            app.reload_operator_map({"cargo_prefixes": ["abx"], "commercial_prefixes": ["vlg"]})
+            self.assertEqual(app.OPERATOR_MAP["cargo_prefixes"], ["ABX"])
+            self.assertEqual(app.PREFIX_LABELS["ABX"], "carga")
+            self.assertEqual(app.PREFIX_LABELS["VLG"], "comercial")
+        finally:
+            app.reload_operator_map(original)
+        self.assertNotIn("ABX", app.PREFIX_LABELS)
+
+
+class TestPrefixIndex(unittest.TestCase):
+    def test_longest_prefix_and_first_group_on_duplicates(self):
+        labels, lengths = _build_prefix_index([("carga", ["AMX", "kq"]), ("comercial", ["AM", "KQ"])])
+        self.assertEqual(lengths, (3, 2))
+        self.assertEqual(labels["AMX"], "carga")
+        self.assertEqual(labels["AM"], "comercial")
+        self.assertEqual(labels["KQ"], "carga")
+
 
 if __name__ == '__main__':
     unittest.main()
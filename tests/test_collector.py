@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+import collector
+
+
+class TestProcesarYGuardar(unittest.TestCase):
+    STATES = [
+        ["abc123", "FDX1 ", "Mexico", 0, 0, -99.1, 19.4, 3000.0, False, 200.5, 90.0],
+        ["def456", None, "Mexico", 0, 0, None, None, None, True, None, None],
+        ["789abc", "AAL100", "USA", 0, 0, -100.0, 20.0, 9000.0, False, 230.0, 10.0],
+    ]
+
+    def setUp(self):
+        collector.estados_previos.clear()
+        self.coleccion = mock.Mock()
+        patcher = mock.patch.object(collector, "coleccion_vuelos", self.coleccion)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._vaciar_cola)
+
+    def _vaciar_cola(self):
+        while not collector.WRITE_Q.empty():
+            collector.WRITE_Q.get_nowait()
+            collector.WRITE_Q.task_done()
+
+    def test_enqueues_and_writes_one_bulk_per_batch(self):
+        collector.procesar_y_guardar(self.STATES)
+        self.coleccion.bulk_write.assert_not_called()
+        collector._escribir_lote(collector._tomar_lote())
+        self.coleccion.bulk_write.assert_called_once()
+        ops = self.coleccion.bulk_write.call_args[0][0]
+        self.assertEqual([op._filter["icao24"] for op in ops], ["abc123", "789abc"])
+        self.assertEqual(ops[0]._doc["$set"]["tipo"], "carga")
+        self.assertEqual(ops[0]._doc["$currentDate"], {"last_seen": True})
+        self.coleccion.update_one.assert_not_called()
+        self.assertEqual(collector.WRITE_Q.unfinished_tasks, 0)
+
+    def _tick(self, states):
+        collector.procesar_y_guardar(states)
+        escritos = 0
+        while not collector.WRITE_Q.empty():
+            lote = collector._tomar_lote()
+            escritos += len(lote)
+            collector._escribir_lote(lote)
+        return escritos
+
+    def test_unchanged_states_are_skipped_until_resync(self):
+        self.assertEqual(self._tick(self.STATES), 2)
+        self.assertEqual(self._tick(self.STATES), 0)
+        moved = [list(self.STATES[0])]
+        moved[0][6] = 19.5
+        self.assertEqual(self._tick(moved), 1)
+        with mock.patch.object(collector, "ultima_resincronizacion", 0):
+            self.assertEqual(self._tick(self.STATES), 2)
+
+    def test_failed_write_is_retried_next_tick(self):
+        self.coleccion.bulk_write.side_effect = Exception("atlas down")
+        self.assertEqual(self._tick(self.STATES), 2)
+        self.coleccion.bulk_write.side_effect = None
+        self.assertEqual(self._tick(self.STATES), 2)
+        self.assertEqual(self._tick(self.STATES), 0)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        with mock.patch.object(collector, "WRITE_Q", collector.queue.Queue(maxsize=1)) as cola:
+            collector.procesar_y_guardar(self.STATES)
+            self.assertEqual(cola.qsize(), 1)
+
+    def test_purges_only_stale_rows(self):
+        collector._purgar_obsoletos()
+        filtro = self.coleccion.delete_many.call_args[0][0]
+        self.assertIn({"last_seen": {"$lt": mock.ANY}}, filtro["$or"])
+
+    def test_without_database_is_noop(self):
+        with mock.patch.object(collector, "coleccion_vuelos", None):
+            collector.procesar_y_guardar(self.STATES)
+        self.assertTrue(collector.WRITE_Q.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
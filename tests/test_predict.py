@@ -0,0 +1,72 @@
+import unittest
+from unittest import mock
+
+import app
+
+
+class TestHourlyAverages(unittest.TestCase):
+    def test_rolls_up_aggregated_rows_in_order(self):
+        fake_db = mock.Mock()
+        fake_db.historical_data.aggregate.return_value = [
+            {"_id": "22", "first_ts": 100, "count": 3, "avg_total": 10.0, "avg_cargo": 2.0, "avg_commercial": 8.0},
+            {"_id": "23", "first_ts": 200, "count": 2, "avg_total": 6.0, "avg_cargo": 1.0, "avg_commercial": 5.0},
+        ]
+        with mock.patch.object(app, "db", fake_db):
+            avg_by_hour, data_points = app._hourly_averages(0)
+        self.assertEqual(data_points, 5)
+        self.assertEqual(list(avg_by_hour), ["22", "23"])
+        self.assertEqual(avg_by_hour["22"], {"avg_total": 10.0, "avg_cargo": 2.0, "avg_commercial": 8.0})
+        pipeline = fake_db.historical_data.aggregate.call_args[0][0]
+        self.assertEqual(pipeline[0], {"$match": {"timestamp": {"$gte": 0}}})
+
+
+class TestPredictCache(unittest.TestCase):
+    def setUp(self):
+        app.response_cache.clear()
+        self.client = app.app.test_client()
+        for target, value in (("db", None), ("obtener_vuelos", mock.Mock(return_value=[]))):
+            patcher = mock.patch.object(app, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(app.gemini_service, "is_available", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reuses_gemini_analysis_within_ttl(self):
+        answer = {"traffic_prediction": "sube", "confidence": "Media"}
+        with mock.patch.object(app.gemini_service, "generate_json", return_value=answer) as gen:
+            first = self.client.get("/analyze/predict")
+            second = self.client.get("/analyze/predict")
+        self.assertEqual(gen.call_count, 1)
+        prediction = first.get_json()["prediction"]
+        self.assertEqual(prediction["traffic_prediction"], "sube")
+        self.assertEqual(prediction["raw_analysis"], "PREDICCIÓN DE TRÁFICO:\nsube\n\nNIVEL DE CONFIANZA:\nMedia")
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(first.headers["Cache-Control"], f"public, max-age={app.PREDICT_CACHE_TTL}")
+
+    def test_aggregation_uses_dedicated_pool_and_flights_stay_on_request_thread(self):
+        threads = {}
+
+        def record(name, value):
+            def call(*args):
+                threads[name] = app.threading.current_thread().name
+                return value
+            return call
+
+        with mock.patch.object(app, "db", mock.Mock()), \
+                mock.patch.object(app, "_hourly_averages", side_effect=record("history", ({}, 0))), \
+                mock.patch.object(app, "obtener_vuelos", side_effect=record("flights", [])), \
+                mock.patch.object(app.gemini_service, "generate_json", return_value={"confidence": "Alta"}):
+            self.assertEqual(self.client.get("/analyze/predict").status_code, 200)
+        self.assertTrue(threads["history"].startswith("ghostflight-predict"))
+        self.assertEqual(threads["flights"], app.threading.current_thread().name)
+
+    def test_failed_analysis_is_not_cached(self):
+        with mock.patch.object(app.gemini_service, "generate_json", side_effect=[None, {"confidence": "Alta"}]) as gen:
+            self.assertEqual(self.client.get("/analyze/predict").status_code, 500)
+            self.assertEqual(self.client.get("/analyze/predict").status_code, 200)
+        self.assertEqual(gen.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
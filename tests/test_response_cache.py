@@ -0,0 +1,171 @@
+import unittest
+from unittest import mock
+
+import app
+
+
+class TestCachedJson(unittest.TestCase):
+    def setUp(self):
+        app.response_cache.clear()
+
+    def test_reuses_body_within_ttl(self):
+        build = mock.Mock(return_value=[{"icao24": "abc123"}])
+        first_body, first_etag, first_data = app._cached_json(("test",), build)
+        second_body, second_etag, second_data = app._cached_json(("test",), build)
+        self.assertEqual(first_data, [{"icao24": "abc123"}])
+        self.assertIs(first_data, second_data)
+        self.assertEqual(first_body, second_body)
+        self.assertEqual(first_etag, second_etag)
+        self.assertEqual(build.call_count, 1)
+
+    def test_counts_hits_and_misses_per_key(self):
+        app.response_cache_stats.clear()
+        build = mock.Mock(return_value=[])
+        for _ in range(3):
+            app._cached_json(("test",), build)
+        app._cached_json(("other",), build, ttl=60)
+        self.assertEqual(app.response_cache_stats[("test",)], {"hits": 2, "misses": 1})
+        self.assertEqual(app.response_cache_stats[("other",)], {"hits": 0, "misses": 1})
+
+    def test_rebuilds_after_ttl(self):
+        build = mock.Mock(return_value=[])
+        with mock.patch("app.time.time", return_value=1000.0):
+            app._cached_json(("test",), build)
+        with mock.patch("app.time.time", return_value=1000.0 + app.RESPONSE_CACHE_TTL):
+            app._cached_json(("test",), build)
+        self.assertEqual(build.call_count, 2)
+
+    def test_unauthorized_drops_entry_and_token(self):
+        app._cached_json(("test",), mock.Mock(return_value=[]))
+        error = app.requests.HTTPError(response=mock.Mock(status_code=401))
+        app.token_cache["access_token"] = "stale"
+        with mock.patch("app.time.time", return_value=10**12):
+            with self.assertRaises(app.requests.HTTPError):
+                app._cached_json(("test",), mock.Mock(side_effect=error))
+        self.assertIsNone(app.response_cache[("test",)]["value"])
+        self.assertIsNone(app.token_cache["access_token"])
+
+
+class TestVuelosEtag(unittest.TestCase):
+    def setUp(self):
+        app.response_cache.clear()
+        self.client = app.app.test_client()
+
+    def test_not_modified_when_etag_matches(self):
+        with mock.patch("app._refresh_vuelos", return_value=[{"icao24": "abc123"}]):
+            first = self.client.get("/vuelos")
+            etag = first.headers["ETag"]
+            second = self.client.get("/vuelos", headers={"If-None-Match": etag})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.get_json(), [{"icao24": "abc123"}])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b"")
+
+    def test_not_modified_with_compressed_etag(self):
+        with mock.patch("app._refresh_vuelos", return_value=[]):
+            etag = self.client.get("/vuelos").headers["ETag"].strip('"').split(":")[0]
+            second = self.client.get("/vuelos", headers={"If-None-Match": f'"{etag}:gzip"'})
+        self.assertEqual(second.status_code, 304)
+
+    def test_type_endpoints_share_the_vuelos_fetch(self):
+        vuelos = [{"icao24": "abc123", "type": "carga"}, {"icao24": "def456", "type": "comercial"}]
+        with mock.patch("app.db", None), \
+                mock.patch("app._refresh_vuelos", return_value=vuelos) as refresh:
+            self.client.get("/vuelos")
+            carga = self.client.get("/vuelos/carga").get_json()
+            comerciales = self.client.get("/vuelos/comerciales").get_json()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual([v["icao24"] for v in carga], ["abc123"])
+        self.assertEqual([v["icao24"] for v in comerciales], ["def456"])
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        app.response_cache.clear()
+        self.client = app.app.test_client()
+
+    def test_prefers_brotli_over_zstd(self):
+        vuelos = [{"icao24": f"abc{i:03d}", "type": "comercial"} for i in range(50)]
+        with mock.patch("app._refresh_vuelos", return_value=vuelos):
+            resp = self.client.get("/vuelos", headers={"Accept-Encoding": "gzip, deflate, br, zstd"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+
+    def test_streamed_responses_are_not_buffered(self):
+        docs = [{"id": i, "type": "test"} for i in range(200)]
+        db = mock.MagicMock()
+        db.alerts.find.return_value.sort.return_value.batch_size.return_value = iter(docs)
+        with mock.patch("app.db", db):
+            resp = self.client.get("/alerts/export", headers={"Accept-Encoding": "gzip"}, buffered=False)
+            self.assertTrue(resp.is_streamed)
+            self.assertNotIn("Content-Encoding", resp.headers)
+            self.assertEqual(len(resp.get_json()), 200)
+
+
+class _FailingCursor:
+    """Cursor perezoso como el de pymongo: el error salta al pedir el primer lote."""
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raise RuntimeError("cursor killed")
+
+
+class TestStoredStreams(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+        self.db = mock.MagicMock()
+        patcher = mock.patch.object(app, "db", self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_streams_stored_flights_without_hint(self):
+        find = self.db.get_collection.return_value.find
+        find.return_value.batch_size.return_value = iter([{"icao24": "abc123"}, {"icao24": "def456"}])
+        resp = self.client.get("/vuelos/carga")
+        self.assertEqual([v["icao24"] for v in resp.get_json()], ["abc123", "def456"])
+        find.return_value.hint.assert_not_called()
+
+    def test_empty_collection_streams_empty_array(self):
+        self.db.get_collection.return_value.find.return_value.batch_size.return_value = iter([])
+        self.assertEqual(self.client.get("/vuelos/comerciales").get_json(), [])
+
+    def test_cursor_error_returns_json_error(self):
+        self.db.get_collection.return_value.find.return_value.batch_size.return_value = _FailingCursor()
+        resp = self.client.get("/vuelos/carga")
+        self.assertEqual(resp.status_code, 500)
+        self.assertEqual(resp.get_json(), {"error": "Error interno"})
+
+    def test_export_falls_back_to_memory_on_cursor_error(self):
+        app.alerts_history.clear()
+        app.alerts_history.append({"id": 1, "type": "test"})
+        self.addCleanup(app.alerts_history.clear)
+        self.db.alerts.find.return_value.sort.return_value.batch_size.return_value = _FailingCursor()
+        resp = self.client.get("/alerts/export")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json(), [{"id": 1, "type": "test"}])
+
+
+class TestAiStatusEtag(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def test_not_modified_while_cache_counters_move(self):
+        first = self.client.get("/ai/status")
+        app._count_cache(app.VUELOS_CACHE_KEY, "hits")
+        second = self.client.get("/ai/status", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("gemini", first.get_json())
+        self.assertEqual(first.headers["Cache-Control"], f"public, max-age={app.AI_STATUS_MAX_AGE}")
+        self.assertEqual(second.status_code, 304)
+
+    def test_cache_counters_have_their_own_uncached_endpoint(self):
+        stats = {app.VUELOS_CACHE_KEY: {"hits": 4, "misses": 2}, ("predict",): {"hits": 9, "misses": 9}}
+        with mock.patch.dict(app.response_cache_stats, stats, clear=True):
+            response = self.client.get("/cache/status")
+        self.assertEqual(response.get_json(), {"ttl": app.RESPONSE_CACHE_TTL, "hits": 4, "misses": 2})
+        self.assertEqual(response.headers["Cache-Control"], "no-store")
+
+
+if __name__ == '__main__':
+    unittest.main()
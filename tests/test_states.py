@@ -0,0 +1,58 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+import app
+
+
+def _fake_response(payload):
+    response = mock.Mock()
+    response.content = json.dumps(payload).encode("utf-8")
+    response.raw = io.BytesIO(response.content)
+    return response
+
+
+class TestIterStates(unittest.TestCase):
+    STATES = [
+        ["abc123", "AMX200 ", "Mexico", 0, 0, -99.1, 19.4, 3000.0, False, 200.5, 90.0],
+        ["def456", None, "Mexico", 0, 0, None, None, None, True, None, None],
+    ]
+
+    def test_streams_rows_with_plain_floats(self):
+        rows = list(app._iter_states(_fake_response({"time": 1, "states": self.STATES})))
+        self.assertEqual(rows, self.STATES)
+        self.assertIsInstance(rows[0][7], float)
+
+    def test_falls_back_to_full_parse_without_ijson(self):
+        with mock.patch("app.ijson", None):
+            rows = list(app._iter_states(_fake_response({"time": 1, "states": self.STATES})))
+        self.assertEqual(rows, self.STATES)
+
+    def test_null_states(self):
+        self.assertEqual(list(app._iter_states(_fake_response({"time": 1, "states": None}))), [])
+
+    def test_with_position_filters_missing_coordinates(self):
+        rows = list(app._with_position(self.STATES))
+        self.assertEqual([r[0] for r in rows], ["abc123"])
+
+
+
+class TestFetchAndClassify(unittest.TestCase):
+    def test_counts_types_in_the_same_pass(self):
+        states = TestIterStates.STATES + [
+            ["ghi789", "FDX12", "USA", 0, 0, -99.0, 19.5, 9000.0, False, 250.0, 180.0],
+            ["jkl012", "VOI310", "Mexico", 0, 0, -99.2, 19.3, 4000.0, False, 180.0, 45.0],
+        ]
+        response = _fake_response({"time": 1, "states": states})
+        response.__enter__ = mock.Mock(return_value=response)
+        response.__exit__ = mock.Mock(return_value=False)
+        with mock.patch("app.obtener_token", return_value="tok"), \
+                mock.patch.object(app.SESSION, "get", return_value=response):
+            vuelos, counts = app._fetch_and_classify_states()
+        self.assertEqual([v["type"] for v in vuelos], ["carga", "carga", "comercial"])
+        self.assertEqual(counts, {"comercial": 1, "carga": 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
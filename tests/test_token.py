@@ -0,0 +1,72 @@
+import unittest
+from unittest import mock
+
+import app
+
+
+class TestObtenerToken(unittest.TestCase):
+    def setUp(self):
+        app.token_cache.update({"access_token": None, "expires_at": 0, "valid_until": 0, "retry_at": 0, "backoff": 0})
+
+    def _token_response(self, token, expires_in=1800):
+        response = mock.Mock()
+        response.json.return_value = {"access_token": token, "expires_in": expires_in}
+        return response
+
+    def test_refreshes_before_real_expiry(self):
+        with mock.patch("app.time.time", return_value=1000.0), \
+                mock.patch.object(app.SESSION, "post", return_value=self._token_response("t1")):
+            self.assertEqual(app.obtener_token(), "t1")
+        self.assertEqual(app.token_cache["valid_until"], 2800.0)
+        self.assertEqual(app.token_cache["expires_at"], 2800.0 - app.TOKEN_REFRESH_MARGIN)
+
+    def test_falls_back_to_stale_token_within_grace_window(self):
+        app.token_cache.update({"access_token": "old", "expires_at": 900.0, "valid_until": 1100.0})
+        with mock.patch("app.time.time", return_value=1000.0), \
+                mock.patch.object(app.SESSION, "post", side_effect=app.requests.ConnectionError("down")):
+            self.assertEqual(app.obtener_token(), "old")
+
+    def test_backs_off_and_serves_stale_token_while_auth_is_down(self):
+        app.token_cache.update({"access_token": "old", "expires_at": 900.0, "valid_until": 1100.0})
+        down = app.requests.ConnectionError("down")
+        with mock.patch.object(app.SESSION, "post", side_effect=down) as post:
+            with mock.patch("app.time.time", return_value=1000.0):
+                self.assertEqual(app.obtener_token(), "old")
+                self.assertEqual(app.obtener_token(), "old")
+            self.assertEqual(post.call_count, 1)
+            self.assertEqual(app.token_cache["retry_at"], 1000.0 + app.TOKEN_RETRY_MIN)
+            with mock.patch("app.time.time", return_value=1000.0 + app.TOKEN_RETRY_MIN):
+                app.obtener_token()
+            self.assertEqual(post.call_count, 2)
+            self.assertEqual(app.token_cache["backoff"], 2 * app.TOKEN_RETRY_MIN)
+
+    def test_backoff_is_capped_and_reset_on_success(self):
+        app.token_cache["backoff"] = app.TOKEN_RETRY_MAX
+        with mock.patch.object(app.SESSION, "post", side_effect=app.requests.ConnectionError("down")):
+            with self.assertRaises(app.requests.ConnectionError):
+                app.obtener_token()
+        self.assertEqual(app.token_cache["backoff"], app.TOKEN_RETRY_MAX)
+        app.token_cache["retry_at"] = 0
+        with mock.patch.object(app.SESSION, "post", return_value=self._token_response("t2")):
+            self.assertEqual(app.obtener_token(), "t2")
+        self.assertEqual((app.token_cache["backoff"], app.token_cache["retry_at"]), (0, 0))
+
+    def test_raises_when_no_valid_token(self):
+        with mock.patch.object(app.SESSION, "post", side_effect=app.requests.ConnectionError("down")):
+            with self.assertRaises(app.requests.ConnectionError):
+                app.obtener_token()
+
+
+class TestTokenRefresher(unittest.TestCase):
+    def test_starts_single_thread_per_process(self):
+        with mock.patch.object(app, "_token_refresher_thread", None), \
+                mock.patch("app.threading.Thread") as thread:
+            first = app.start_token_refresher()
+            second = app.start_token_refresher()
+        self.assertIs(first, second)
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+from unittest import mock
+
+import app
+
+
+def _rpc(body):
+    response = mock.Mock()
+    response.json.return_value = body
+    return response
+
+
+class TestZabbixPush(unittest.TestCase):
+    def setUp(self):
+        app.zabbix_token_cache.update({"auth": None, "expires_at": 0})
+        for name, value in (("ZABBIX_API", "http://zbx/api_jsonrpc.php"), ("ZABBIX_USER", "u"), ("ZABBIX_PASS", "p")):
+            patcher = mock.patch.object(app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_logs_in_with_username_and_pushes_with_bearer(self):
+        with mock.patch.object(app.SESSION, "post", side_effect=[_rpc({"result": "tok"}), _rpc({"result": {}})]) as post:
+            app.send_zabbix_metrics({"flights.carga.count": 3})
+        login, push = post.call_args_list
+        self.assertEqual(login.kwargs["json"]["params"], {"username": "u", "password": "p"})
+        self.assertNotIn("auth", push.kwargs["json"])
+        self.assertEqual(push.kwargs["headers"], {"Authorization": "Bearer tok"})
+
+    def test_login_error_is_logged_and_nothing_pushed(self):
+        with mock.patch.object(app.SESSION, "post", return_value=_rpc({"error": {"data": "bad"}})) as post, \
+                self.assertLogs("app", level="WARNING") as logs:
+            app.send_zabbix_metrics({"flights.carga.count": 3})
+        self.assertEqual(post.call_count, 1)
+        self.assertIn("user.login failed", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
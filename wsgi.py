@@ -0,0 +1,15 @@
+"""Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+El parcheo de gevent debe ocurrir antes de importar `requests`/`pymongo` para
+que sus sockets sean cooperativos y una llamada lenta a OpenSky no bloquee al
+resto de peticiones del worker.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+from app import app, start_token_refresher  # noqa: E402
+
+start_token_refresher()